@@ -3,25 +3,38 @@ Face Recognition Attendance System - Universal CCTV Support
 Supports: RTSP, MJPEG, HTTP, DroidCam, IP Webcam, and all camera types
 """
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, send_file
 from flask_cors import CORS
+from werkzeug.utils import secure_filename
 import cv2
 import numpy as np
 import csv
+import json
 import os
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from pathlib import Path
 import openpyxl
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Font, PatternFill, Alignment
 import pickle
+import copy
 import base64
 import io
 from PIL import Image
 import secrets
 import hashlib
 import threading
+import time
+import queue
+import sqlite3
+import atexit
+import zlib
+import zipfile
+import bisect
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from recognition_engine import FaceGallery, ProjectedGallery, RecognitionEngine, FACE_SIZE, MATCH_THRESHOLD
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(32)
@@ -30,8 +43,1309 @@ CORS(app)
 DEFAULT_USERNAME = "admin"
 DEFAULT_PASSWORD = "admin"
 
-camera_captures = {}
-camera_locks = {}
+camera_readers = {}
+camera_readers_lock = threading.Lock()
+recognition_workers = {}
+recognition_workers_lock = threading.Lock()
+frame_slots = {}
+frame_slots_lock = threading.Lock()
+# Batched frames are decoded and detected here; each thread has its own cascade
+batch_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix='batch-frame')
+
+FACE_INDEX_VERSION = 1
+DEFAULT_RECOGNITION_FPS = 2.0
+MAX_RECOGNITION_FPS = 15.0
+STREAM_FRAME_TIMEOUT = 10.0
+MJPEG_BUFFER_SIZE = 256 * 1024
+MJPEG_HEADER_READ = 1024
+MJPEG_SCAN_READ = 64 * 1024
+MJPEG_MAX_HEADER = 8 * 1024
+MJPEG_MAX_FRAME = 16 * 1024 * 1024
+ROLLUP_TABLES = {
+    'attendance_rollup_days': 'date',
+    'attendance_rollup_months': 'month',
+    'attendance_rollup_employees': 'employee_id'
+}
+STREAM_PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+# Output profiles for /api/cctv-stream?profile=...; a camera's 'stream_profiles'
+# setting overrides or adds to these. No size means the source size; no quality
+# means the camera's own JPEG is relayed untouched when there is one.
+DEFAULT_STREAM_PROFILES = {
+    'thumbnail': {'width': 320, 'height': 240, 'quality': 60, 'max_fps': 5},
+    '640p': {'width': 640, 'height': 480, 'quality': 80, 'max_fps': 0},
+    'full': {'width': None, 'height': None, 'quality': None, 'max_fps': 0}
+}
+FULL_FRAME_QUALITY = 90
+WORKBOOK_EXPORT_INTERVAL = 60.0
+ATTENDANCE_WRITE_RETRIES = 5
+ATTENDANCE_RETRY_MAX_DELAY = 30.0
+CSV_STREAM_CHUNK_SIZE = 64 * 1024
+TRACK_DETECT_EVERY = 5
+TRACK_IOU_THRESHOLD = 0.3
+TRACK_MAX_MISSES = 2
+TRACK_SEARCH_MARGIN = 0.5
+TRACKER_IDLE_TIMEOUT = 300.0
+JOURNAL_KEEP_DAYS = 7
+SETTINGS_RECHECK_INTERVAL = 1.0
+FRAME_HINT_MIN_MS = 250
+FRAME_HINT_MAX_MS = 5000
+MAX_BATCH_FRAMES = 32
+BULK_ENROLL_WORKERS = os.cpu_count() or 4
+ENROLLMENT_MANIFEST_NAMES = ('manifest.csv', 'employees.csv', 'registration.csv')
+ENROLLMENT_COLUMNS = {
+    'employee_id': 'Employee_ID', 'emp_id': 'Employee_ID', 'id': 'Employee_ID',
+    'name': 'Name', 'phone': 'Phone', 'address': 'Address',
+    'photo': 'Photo', 'photo_file': 'Photo', 'photo_path': 'Photo', 'file': 'Photo', 'filename': 'Photo'
+}
+# 0 keeps the full-pixel matcher; otherwise galleries larger than this many
+# faces are stored as projected embeddings of this length.
+FACE_EMBEDDING_DIMS = int(os.environ.get('FACE_EMBEDDING_DIMS', '0'))
+# Rebuilds keep the current projection basis until the gallery has grown by
+# more than this fraction since it was fitted.
+EMBEDDING_REFIT_GROWTH = 0.1
+# 0 scores every face against the whole gallery; otherwise galleries larger
+# than this are split into k-means cells and only the nearest few are scored.
+# Worth it for projected galleries; on pixel templates brute force usually wins.
+GALLERY_INDEX_CELLS = int(os.environ.get('GALLERY_INDEX_CELLS', '0'))
+GALLERY_INDEX_PROBES = int(os.environ.get('GALLERY_INDEX_PROBES', '8'))
+MOTION_WIDTH = 160
+MOTION_PIXEL_DELTA = 25
+MOTION_DEFAULT_THRESHOLD = 0.01
+MOTION_MAX_SKIP = 30
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ''
+    escaped = []
+    for key, value in items:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values = {}
+    
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(key)} {value}')
+        return lines
+
+class Gauge:
+    """Gauge whose samples come from a callback returning {labels tuple: value}."""
+    
+    def __init__(self, name, help_text, collect):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        for key, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{format_labels(key)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}
+    
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{format_labels(key, [("le", bound)])} {cumulative}')
+                lines.append(f'{self.name}_bucket{format_labels(key, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{format_labels(key)} {total}')
+                lines.append(f'{self.name}_count{format_labels(key)} {count}')
+        return lines
+
+def collect_camera_readers(attribute):
+    with camera_readers_lock:
+        readers = list(camera_readers.values())
+    return {(('camera', reader.camera['id']),): getattr(reader, attribute) for reader in readers}
+
+FRAME_STAGE_SECONDS = Histogram('facerec_frame_stage_seconds',
+                                'Time spent in each stage of frame recognition.')
+FRAME_ERRORS = Counter('facerec_frame_errors_total', 'Frames that failed, by stage.')
+FRAMES_SKIPPED = Counter('facerec_frames_skipped_total', 'Frames skipped without recognition, by reason.')
+CAMERA_FRAMES = Counter('facerec_camera_frames_total', 'Frames read from each camera upstream.')
+CAMERA_RECONNECTS = Counter('facerec_camera_reconnects_total', 'Upstream reconnects per camera.')
+CAMERA_FPS = Gauge('facerec_camera_fps', 'Recent upstream frame rate per camera.',
+                   lambda: collect_camera_readers('fps'))
+CAMERA_SUBSCRIBERS = Gauge('facerec_camera_subscribers', 'Viewers and workers attached to each camera.',
+                           lambda: collect_camera_readers('subscribers'))
+ATTENDANCE_WRITE_SECONDS = Histogram('facerec_attendance_write_seconds',
+                                     'Latency of attendance log batch commits.')
+ATTENDANCE_EVENTS_WRITTEN = Counter('facerec_attendance_events_written_total',
+                                    'Attendance events committed to the log.')
+ATTENDANCE_WRITE_FAILURES = Counter('facerec_attendance_write_failures_total',
+                                    'Failed attendance writes, by stage.')
+STREAM_ENCODES = Counter('facerec_stream_encodes_total', 'JPEG encodes per camera and output profile.')
+
+METRICS = [FRAME_STAGE_SECONDS, FRAME_ERRORS, FRAMES_SKIPPED, CAMERA_FRAMES, CAMERA_RECONNECTS,
+           CAMERA_FPS, CAMERA_SUBSCRIBERS, ATTENDANCE_WRITE_SECONDS, ATTENDANCE_EVENTS_WRITTEN,
+           ATTENDANCE_WRITE_FAILURES, STREAM_ENCODES]
+
+def decode_gray(image_bytes):
+    # One libjpeg decode straight to the luma plane that detection uses
+    return cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+def is_mjpeg_url(camera_url):
+    return any(x in camera_url.lower() for x in ['mjpeg', 'video', ':4747', ':8080', 'droidcam'])
+
+class FaceTrack:
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.emp_data = None
+        self.misses = 0
+
+def box_iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+class MotionGate:
+    """Cheap frame-difference check that decides whether detection is worth running.
+    
+    Works on a blurred thumbnail of the frame. The threshold is the fraction of
+    thumbnail pixels that must change by more than MOTION_PIXEL_DELTA; 0 turns
+    the gate off. A frame is always let through after MOTION_MAX_SKIP skips so
+    slow drift can't hide someone forever.
+    """
+    
+    def __init__(self):
+        self.previous = None
+        self.processed = 0
+        self.skipped = 0
+        self.since_processed = 0
+    
+    def has_motion(self, gray, threshold):
+        height, width = gray.shape[:2]
+        size = (MOTION_WIDTH, max(1, int(height * MOTION_WIDTH / width)))
+        small = cv2.GaussianBlur(cv2.resize(gray, size, interpolation=cv2.INTER_AREA), (5, 5), 0)
+        
+        previous, self.previous = self.previous, small
+        
+        if threshold <= 0 or previous is None or self.since_processed >= MOTION_MAX_SKIP:
+            moving = True
+        else:
+            diff = cv2.absdiff(small, previous)
+            moving = np.count_nonzero(diff > MOTION_PIXEL_DELTA) >= threshold * diff.size
+        
+        if moving:
+            self.processed += 1
+            self.since_processed = 0
+        else:
+            self.skipped += 1
+            self.since_processed += 1
+        return moving
+    
+    def stats(self):
+        total = self.processed + self.skipped
+        return {
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'skip_rate': round(self.skipped / total, 3) if total else 0.0
+        }
+
+class FaceTracker:
+    """Keeps faces from one camera/client alive across frames.
+    
+    The whole frame is only searched every TRACK_DETECT_EVERY frames or after a
+    track is lost; in between, detection runs in a small window around each
+    track. Tracks are matched to boxes by overlap, and the gallery is only
+    consulted for tracks that don't have an identity yet.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tracks = []
+        self.next_track_id = 1
+        self.frame_index = 0
+        self.last_detection = None
+        self.lost = False
+        self.last_used = time.monotonic()
+        self.motion = MotionGate()
+    
+    def search_near_tracks(self, system, gray):
+        boxes = []
+        height, width = gray.shape[:2]
+        
+        for track in self.tracks:
+            x, y, w, h = track.box
+            pad_x, pad_y = int(w * TRACK_SEARCH_MARGIN), int(h * TRACK_SEARCH_MARGIN)
+            x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+            x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+            
+            found = system.detect_faces(gray[y0:y1, x0:x1])
+            if len(found) == 0:
+                self.lost = True
+                continue
+            
+            candidates = [(fx + x0, fy + y0, fw, fh) for (fx, fy, fw, fh) in found]
+            boxes.append(max(candidates, key=lambda box: box_iou(box, track.box)))
+        
+        return boxes
+    
+    def update(self, system, gray, motion_threshold=MOTION_DEFAULT_THRESHOLD):
+        with FRAME_STAGE_SECONDS.time(stage='motion'):
+            moving = self.motion.has_motion(gray, motion_threshold)
+        if not moving:
+            FRAMES_SKIPPED.inc(reason='static')
+            # Static scene: whatever we were tracking is still where it was
+            return [system.face_result(track.box, track.emp_data, False, track.track_id)
+                    for track in self.tracks if track.misses == 0]
+        
+        self.frame_index += 1
+        
+        full_detection = (self.last_detection is None or self.lost or not self.tracks or
+                          self.frame_index - self.last_detection >= TRACK_DETECT_EVERY)
+        box_matches = None
+        if full_detection:
+            boxes, box_matches = system.detect_and_match(gray)
+            self.last_detection = self.frame_index
+            self.lost = False
+        else:
+            with FRAME_STAGE_SECONDS.time(stage='track'):
+                boxes = [tuple(int(v) for v in box) for box in self.search_near_tracks(system, gray)]
+        
+        # Greedy association, best overlap first
+        pairs = sorted(((box_iou(track.box, box), ti, bi)
+                        for ti, track in enumerate(self.tracks)
+                        for bi, box in enumerate(boxes)), reverse=True)
+        
+        seen = []
+        seen_box = {}
+        used_tracks, used_boxes = set(), set()
+        for iou, ti, bi in pairs:
+            if iou < TRACK_IOU_THRESHOLD:
+                break
+            if ti in used_tracks or bi in used_boxes:
+                continue
+            used_tracks.add(ti)
+            used_boxes.add(bi)
+            track = self.tracks[ti]
+            track.box = boxes[bi]
+            track.misses = 0
+            seen.append(track)
+            seen_box[track.track_id] = bi
+        
+        survivors = []
+        for ti, track in enumerate(self.tracks):
+            if ti in used_tracks:
+                survivors.append(track)
+            else:
+                track.misses += 1
+                if track.misses <= TRACK_MAX_MISSES:
+                    survivors.append(track)
+        
+        for bi, box in enumerate(boxes):
+            if bi not in used_boxes:
+                track = FaceTrack(self.next_track_id, box)
+                self.next_track_id += 1
+                survivors.append(track)
+                seen.append(track)
+                seen_box[track.track_id] = bi
+        
+        self.tracks = survivors
+        
+        pending = [track for track in seen if track.emp_data is None]
+        if box_matches is not None:
+            matches = [box_matches[seen_box[track.track_id]] for track in pending]
+        else:
+            with FRAME_STAGE_SECONDS.time(stage='match'):
+                matches = system.gallery.match([system.face_crop(gray, track.box) for track in pending])
+        
+        newly_marked = set()
+        for track, (best_match_emp, best_match_score) in zip(pending, matches):
+            if best_match_emp is not None and best_match_score > MATCH_THRESHOLD:
+                track.emp_data = best_match_emp
+                if system.record_match(best_match_emp):
+                    newly_marked.add(track.track_id)
+        
+        return [system.face_result(track.box, track.emp_data, track.track_id in newly_marked, track.track_id)
+                for track in seen]
+
+def stream_part(jpeg):
+    """One multipart/x-mixed-replace part, built once and shared by every viewer."""
+    return b''.join((STREAM_PART_HEADER % len(jpeg), jpeg, b'\r\n'))
+
+class MjpegStream:
+    """Incremental MJPEG parser over a single reusable receive buffer.
+    
+    Parts are found by the multipart boundary from the Content-Type header and
+    sized by their Content-Length when the camera sends one, so each read asks
+    for exactly the bytes still missing. Otherwise a part's JPEG is walked
+    segment by segment up to the start of scan and ends at the next EOI, so a
+    frame is published as soon as its last byte arrives and an EXIF
+    thumbnail's own SOI/EOI can't cut it short. Without a boundary, or when
+    the declared one never shows up, frames are found the same way by their
+    SOI, skipping whatever the camera sends in between. Open-ended scans read
+    whatever has arrived rather than waiting for a full read.
+    
+    Payloads are memoryviews into the buffer, valid until the next one is
+    requested.
+    """
+    
+    def __init__(self, raw, boundary=None, buffer_size=MJPEG_BUFFER_SIZE):
+        self.raw = raw
+        self.read1 = getattr(raw, 'read1', None)
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+        self.marker = b'--' + boundary.strip('"').lstrip('-').encode('latin-1') if boundary else None
+    
+    @staticmethod
+    def boundary_from(content_type):
+        for param in (content_type or '').split(';')[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.lower() == 'boundary' and value:
+                return value
+        return None
+    
+    def fill(self, wanted, exact=True):
+        """Read more bytes: exactly `wanted`, or up to `wanted` of whatever has arrived."""
+        pending = self.end - self.start
+        if pending + wanted > MJPEG_MAX_FRAME:
+            raise ValueError(f'MJPEG frame larger than {MJPEG_MAX_FRAME} bytes')
+        if self.end + wanted > len(self.buffer):
+            if pending + wanted > len(self.buffer):
+                grown = bytearray(max(len(self.buffer) * 2, pending + wanted))
+                grown[:pending] = self.view[self.start:self.end]
+                self.buffer = grown
+                self.view = memoryview(self.buffer)
+            else:
+                # Only the unconsumed tail (usually a partial header) moves
+                self.buffer[:pending] = bytes(self.view[self.start:self.end])
+            self.start, self.end = 0, pending
+        
+        if exact or self.read1 is None:
+            # readinto blocks until the view is full, so open-ended reads stay small
+            size = wanted if exact else min(wanted, MJPEG_HEADER_READ)
+            count = self.raw.readinto(self.view[self.end:self.end + size])
+        else:
+            chunk = self.read1(wanted)
+            count = len(chunk) if chunk else 0
+            self.view[self.end:self.end + count] = chunk
+        if not count:
+            raise EOFError('MJPEG stream ended')
+        self.end += count
+    
+    def need(self, count):
+        """Make sure `count` bytes from self.start are buffered."""
+        while self.end - self.start < count:
+            self.fill(count - (self.end - self.start))
+    
+    def find(self, token, scan_from, read_size, limit=None):
+        """Offset of token at or after scan_from, reading more as needed.
+        
+        With a limit, gives up (-1) once that many bytes past self.start are
+        buffered without a match.
+        """
+        while True:
+            found = self.buffer.find(token, scan_from, self.end)
+            if found != -1:
+                return found
+            if limit is not None and self.end - self.start > limit:
+                return -1
+            # Keep a possible partial token at the end; never rescan the rest
+            offset = max(scan_from, self.end - len(token) + 1) - self.start
+            self.fill(read_size, exact=False)
+            scan_from = self.start + offset
+    
+    def jpeg_end(self):
+        """Offset just past the EOI of the JPEG starting at self.start, or None.
+        
+        Header segments are skipped by their lengths up to the start of scan;
+        in the entropy-coded data every 0xFF is stuffed or a restart marker,
+        so the next FFD9 is the frame's own EOI.
+        """
+        offset = 2
+        while True:
+            self.need(offset + 4)
+            at = self.start + offset
+            if self.buffer[at] != 0xFF:
+                return None
+            marker = self.buffer[at + 1]
+            if marker == 0xFF:
+                offset += 1
+            elif 0xD0 <= marker <= 0xD7 or marker == 0x01:
+                offset += 2
+            elif marker in (0xD8, 0xD9):
+                return None
+            else:
+                offset += 2 + ((self.buffer[at + 2] << 8) | self.buffer[at + 3])
+                if marker == 0xDA:
+                    break
+        return self.find(b'\xff\xd9', self.start + offset, MJPEG_SCAN_READ) + 2
+    
+    def frames(self):
+        if self.marker is None:
+            yield from self.marker_frames()
+            return
+        
+        while True:
+            found = self.find(self.marker, self.start, MJPEG_HEADER_READ, limit=MJPEG_MAX_HEADER)
+            if found == -1:
+                print(f"MJPEG boundary {self.marker[2:].decode('latin-1')!r} not found, splitting on JPEG markers")
+                yield from self.marker_frames()
+                return
+            
+            self.start = found + len(self.marker)
+            header_end = self.find(b'\r\n\r\n', self.start, MJPEG_HEADER_READ, limit=MJPEG_MAX_HEADER)
+            if header_end == -1:
+                raise ValueError('MJPEG part header too long')
+            
+            length = None
+            for line in bytes(self.view[self.start:header_end]).split(b'\r\n'):
+                key, _, value = line.partition(b':')
+                if key.strip().lower() == b'content-length' and value.strip().isdigit():
+                    length = int(value)
+            self.start = header_end + 4
+            
+            if length is not None:
+                self.need(length)
+                payload_end = self.start + length
+            else:
+                self.need(2)
+                payload_end = self.jpeg_end() if self.buffer[self.start:self.start + 2] == b'\xff\xd8' else None
+                if payload_end is None:
+                    payload_end = self.find(b'\r\n' + self.marker, self.start, MJPEG_SCAN_READ)
+            
+            payload = self.view[self.start:payload_end]
+            self.start = payload_end
+            if payload[:2] == b'\xff\xd8':
+                yield payload
+    
+    def marker_frames(self):
+        while True:
+            self.start = self.find(b'\xff\xd8', self.start, MJPEG_SCAN_READ)
+            frame_end = self.jpeg_end()
+            if frame_end is None:
+                # Not a JPEG after all; look for the next SOI
+                self.start += 2
+                continue
+            payload = self.view[self.start:frame_end]
+            self.start = frame_end
+            yield payload
+
+def camera_stream_profiles(camera):
+    profiles = copy.deepcopy(DEFAULT_STREAM_PROFILES)
+    for name, spec in (camera.get('stream_profiles') or {}).items():
+        profiles[name] = {**profiles.get(name, DEFAULT_STREAM_PROFILES['full']), **spec}
+    return profiles
+
+class EncodedStream:
+    """One output profile of a camera, encoded once and shared by its viewers.
+    
+    The first viewer to ask for a new source frame encodes it while holding
+    the lock; the others wait on the lock and get the same bytes. max_fps
+    spaces encodes out, so viewers of a slow profile simply wait longer.
+    """
+    
+    def __init__(self, reader, name, spec):
+        self.reader = reader
+        self.name = name
+        self.spec = dict(spec)
+        self.width = spec.get('width')
+        self.height = spec.get('height')
+        self.quality = spec.get('quality')
+        max_fps = spec.get('max_fps') or 0
+        self.interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.part = None
+        self.encoded_at = 0.0
+    
+    def encode(self, part, jpeg, frame):
+        if self.width is None and self.quality is None and part is not None:
+            return part
+        
+        if frame is None or frame.ndim != 3:
+            frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                return None
+        if self.width and self.height and (frame.shape[1], frame.shape[0]) != (self.width, self.height):
+            frame = cv2.resize(frame, (self.width, self.height), interpolation=cv2.INTER_AREA)
+        
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality or FULL_FRAME_QUALITY])
+        if not ret:
+            return None
+        STREAM_ENCODES.inc(camera=self.reader.camera['id'], profile=self.name)
+        return stream_part(buffer)
+    
+    def next_part(self, last_sequence, timeout=STREAM_FRAME_TIMEOUT):
+        """(sequence, part) newer than last_sequence, or (last_sequence, None) on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                current = time.monotonic() - self.encoded_at < self.interval or self.sequence == self.reader.sequence
+                if self.part is not None and self.sequence != last_sequence and current:
+                    return self.sequence, self.part
+            
+            delay = self.encoded_at + self.interval - time.monotonic()
+            if delay > 0 and self.reader.stop_event.wait(delay):
+                return last_sequence, None
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return last_sequence, None
+            sequence, part, jpeg, frame = self.reader.wait_latest(self.sequence, remaining)
+            if jpeg is None and frame is None:
+                return last_sequence, None
+            
+            with self.lock:
+                if sequence > self.sequence:
+                    encoded = self.encode(part, jpeg, frame)
+                    self.sequence = sequence
+                    self.encoded_at = time.monotonic()
+                    if encoded is not None:
+                        self.part = encoded
+                if self.part is not None and self.sequence != last_sequence:
+                    return self.sequence, self.part
+            # Nothing encoded yet (the first frame failed); wait for the next one
+
+class CameraReader(threading.Thread):
+    """Single upstream connection to a camera, shared by every viewer and worker.
+    
+    Only the latest frame is kept. Subscribers wait for a newer sequence number
+    and skip whatever they missed, so a slow viewer drops frames instead of
+    holding up the upstream read.
+    """
+    
+    def __init__(self, camera):
+        super().__init__(name=f"camera-{camera['id']}", daemon=True)
+        self.camera = camera
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.subscribers = 0
+        
+        self.sequence = 0
+        self.jpeg = None
+        self.part = None
+        self.frame = None
+        self.encoded_streams = {}
+        self.reconnects = 0
+        self.last_error = None
+        self.fps = 0.0
+        self.last_publish = None
+    
+    def stop(self):
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+    
+    def publish(self, jpeg, frame=None):
+        now = time.monotonic()
+        if self.last_publish is not None and now > self.last_publish:
+            # Exponential moving average so one stall doesn't zero the gauge
+            self.fps = 0.9 * self.fps + 0.1 / (now - self.last_publish)
+        self.last_publish = now
+        CAMERA_FRAMES.inc(camera=self.camera['id'])
+        
+        # The single copy out of the receive buffer; jpeg becomes a view into it
+        part = None
+        if jpeg is not None:
+            part = stream_part(jpeg)
+            header_size = len(part) - len(jpeg) - 2
+            jpeg = memoryview(part)[header_size:header_size + len(jpeg)]
+        
+        with self.condition:
+            self.part = part
+            self.jpeg = jpeg
+            self.frame = frame
+            self.sequence += 1
+            self.condition.notify_all()
+    
+    def wait_latest(self, last_sequence, timeout=STREAM_FRAME_TIMEOUT):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.sequence != last_sequence or self.stop_event.is_set(), timeout)
+            if self.sequence == last_sequence:
+                return last_sequence, None, None, None
+            return self.sequence, self.part, self.jpeg, self.frame
+    
+    def wait_frame(self, last_sequence, timeout=STREAM_FRAME_TIMEOUT):
+        """(sequence, jpeg, frame); OpenCV sources publish only the frame, MJPEG only the JPEG."""
+        sequence, _, jpeg, frame = self.wait_latest(last_sequence, timeout)
+        return sequence, jpeg, frame
+    
+    def encoded_stream(self, name, spec):
+        """The shared stream for a profile; an edited profile replaces the old one."""
+        with self.condition:
+            stream = self.encoded_streams.get(name)
+            if stream is None or stream.spec != spec:
+                stream = self.encoded_streams[name] = EncodedStream(self, name, spec)
+            return stream
+    
+    def read_mjpeg(self, camera_url):
+        response = requests.get(camera_url, stream=True, timeout=5)
+        try:
+            if response.status_code != 200:
+                self.last_error = f'HTTP {response.status_code}'
+                return
+            
+            boundary = MjpegStream.boundary_from(response.headers.get('Content-Type'))
+            stream = MjpegStream(response.raw, boundary)
+            try:
+                for jpeg in stream.frames():
+                    if self.stop_event.is_set():
+                        break
+                    self.publish(jpeg)
+            except EOFError:
+                self.last_error = 'Stream ended'
+        finally:
+            response.close()
+    
+    def read_opencv(self, camera_url):
+        cap = cv2.VideoCapture(camera_url)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        
+        try:
+            if not cap.isOpened():
+                self.last_error = 'Failed to open camera'
+                return
+            
+            while not self.stop_event.is_set():
+                success, frame = cap.read()
+                if not success:
+                    self.last_error = 'Failed to read frame'
+                    break
+                
+                # Encoding happens per output profile, only for profiles being watched
+                self.publish(None, frame)
+        finally:
+            cap.release()
+    
+    def run(self):
+        camera_url = self.camera['url']
+        retry_delay = 1.0
+        
+        while not self.stop_event.is_set():
+            started = self.sequence
+            try:
+                if is_mjpeg_url(camera_url):
+                    print(f"Using MJPEG mode for: {camera_url}")
+                    self.read_mjpeg(camera_url)
+                else:
+                    print(f"Using OpenCV mode for: {camera_url}")
+                    self.read_opencv(camera_url)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Stream error for camera {self.camera['id']}: {str(e)}")
+            
+            if self.stop_event.is_set():
+                break
+            
+            if self.sequence != started:
+                retry_delay = 1.0
+            self.reconnects += 1
+            self.fps = 0.0
+            self.last_publish = None
+            CAMERA_RECONNECTS.inc(camera=self.camera['id'])
+            self.stop_event.wait(retry_delay)
+            retry_delay = min(retry_delay * 2, 30.0)
+        
+        with self.condition:
+            self.condition.notify_all()
+
+def acquire_camera_reader(camera):
+    with camera_readers_lock:
+        reader = camera_readers.get(camera['id'])
+        if reader is None or reader.stop_event.is_set() or not reader.is_alive():
+            reader = CameraReader(camera)
+            camera_readers[camera['id']] = reader
+            reader.start()
+        reader.subscribers += 1
+        return reader
+
+def release_camera_reader(reader):
+    with camera_readers_lock:
+        reader.subscribers -= 1
+        if reader.subscribers <= 0:
+            reader.stop()
+            if camera_readers.get(reader.camera['id']) is reader:
+                del camera_readers[reader.camera['id']]
+
+def stop_camera_reader(camera_id):
+    with camera_readers_lock:
+        reader = camera_readers.pop(camera_id, None)
+    if reader is not None:
+        reader.stop()
+
+class CameraRecognitionWorker(threading.Thread):
+    """Pulls frames from a CCTV camera and marks attendance without a browser."""
+    
+    def __init__(self, system, camera, fps=DEFAULT_RECOGNITION_FPS):
+        super().__init__(name=f"recognition-{camera['id']}", daemon=True)
+        self.system = system
+        self.camera = camera
+        self.fps = fps
+        self.stop_event = threading.Event()
+        
+        self.started_at = None
+        self.last_frame_at = None
+        self.frames_processed = 0
+        self.faces_detected = 0
+        self.attendance_marked = 0
+        self.reconnects = 0
+        self.last_error = None
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def status(self):
+        return {
+            'camera_id': self.camera['id'],
+            'running': self.is_alive() and not self.stop_event.is_set(),
+            'fps': self.fps,
+            'started_at': self.started_at,
+            'last_frame_at': self.last_frame_at,
+            'frames_processed': self.frames_processed,
+            'faces_detected': self.faces_detected,
+            'attendance_marked': self.attendance_marked,
+            'reconnects': self.reconnects,
+            'last_error': self.last_error,
+            'motion': self.system.motion_stats().get(f"camera-{self.camera['id']}")
+        }
+    
+    def run(self):
+        self.started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        interval = 1.0 / self.fps
+        next_run = 0.0
+        sequence = 0
+        
+        # Share the camera's upstream connection with any live viewers
+        reader = acquire_camera_reader(self.camera)
+        try:
+            while not self.stop_event.is_set():
+                sequence, jpeg, frame = reader.wait_frame(sequence, timeout=1.0)
+                self.reconnects = reader.reconnects
+                
+                if reader.stop_event.is_set() and not self.stop_event.is_set():
+                    release_camera_reader(reader)
+                    reader = acquire_camera_reader(self.camera)
+                    sequence = 0
+                    continue
+                
+                if jpeg is None and frame is None:
+                    self.last_error = reader.last_error
+                    continue
+                
+                now = time.monotonic()
+                if now < next_run:
+                    continue
+                next_run = now + interval
+                
+                try:
+                    if frame is None:
+                        frame = decode_gray(jpeg)
+                    if frame is None:
+                        continue
+                    
+                    threshold = self.camera.get('motion_threshold', MOTION_DEFAULT_THRESHOLD)
+                    results = self.system.process_frame(frame, f"camera-{self.camera['id']}", threshold)
+                    self.frames_processed += 1
+                    self.faces_detected += len(results)
+                    self.attendance_marked += sum(1 for face in results if face['attended'])
+                    self.last_frame_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                except Exception as e:
+                    self.last_error = str(e)
+        finally:
+            release_camera_reader(reader)
+
+class AttendanceLog:
+    """Append-only attendance event log in SQLite (WAL mode).
+    
+    mark_attendance only enqueues; a single writer thread drains the queue and
+    commits events in batches, so a burst of arrivals costs one fsync per batch
+    rather than one workbook rewrite per person. A failed commit is retried
+    with exponential backoff; events are never dropped, but after
+    ATTENDANCE_WRITE_RETRIES failures in a row flush() reports the error.
+    """
+    
+    def __init__(self, db_path, batch_size=256, batch_window=0.2):
+        self.db_path = str(db_path)
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.queue = queue.Queue()
+        self.dirty_days = set()
+        self.dirty_lock = threading.Lock()
+        self.last_error = None
+        # Called on the writer thread with each committed batch of events
+        self.on_commit = None
+        
+        conn = self.connect()
+        try:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS attendance_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    date TEXT NOT NULL,
+                    time TEXT NOT NULL,
+                    employee_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    minutes_late INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_attendance_events_date ON attendance_events (date);
+                CREATE INDEX IF NOT EXISTS idx_attendance_events_employee ON attendance_events (employee_id, date);
+                CREATE TABLE IF NOT EXISTS imported_days (date TEXT PRIMARY KEY);
+            ''')
+            created = self.create_rollups(conn)
+            conn.commit()
+        finally:
+            conn.close()
+        
+        if created:
+            self.rebuild_rollups()
+        
+        self.writer = threading.Thread(target=self.run, name='attendance-log-writer', daemon=True)
+        self.writer.start()
+    
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+    
+    def append(self, event):
+        self.queue.put(event)
+    
+    def flush(self, timeout=10):
+        """Wait until everything appended so far is committed; RuntimeError if it can't be."""
+        done = threading.Event()
+        done.error = None
+        self.queue.put(done)
+        if not done.wait(timeout):
+            raise RuntimeError(f"Attendance log flush timed out ({self.last_error or 'writer busy'})")
+        if done.error:
+            raise RuntimeError(f"Attendance log write failed: {done.error}")
+    
+    def take_dirty_days(self):
+        with self.dirty_lock:
+            days = self.dirty_days
+            self.dirty_days = set()
+        return days
+    
+    def write_events(self, conn, events):
+        conn.executemany(
+            'INSERT INTO attendance_events (date, time, employee_id, name, status, minutes_late) '
+            'VALUES (:date, :time, :employee_id, :name, :status, :minutes_late)',
+            events)
+        self.update_rollups(conn, events)
+    
+    def create_rollups(self, conn):
+        """Create the rollup tables; True if they did not exist yet."""
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                              "AND name = 'attendance_rollup_days'").fetchone()
+        for table, key in ROLLUP_TABLES.items():
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {key} TEXT PRIMARY KEY,
+                    name TEXT NOT NULL DEFAULT '',
+                    present INTEGER NOT NULL DEFAULT 0,
+                    late INTEGER NOT NULL DEFAULT 0,
+                    minutes_late INTEGER NOT NULL DEFAULT 0,
+                    first_arrival TEXT NOT NULL,
+                    last_arrival TEXT NOT NULL
+                )''')
+        return exists is None
+    
+    def update_rollups(self, conn, events):
+        """Fold a batch of events into the day, month and employee rollups.
+        
+        Runs inside the transaction that inserts the events, so the rollups
+        never disagree with the log. The batch is summed per key first, which
+        makes it one upsert per key instead of one per event.
+        """
+        for table, key in ROLLUP_TABLES.items():
+            totals = {}
+            for event in events:
+                group = event['date'][:7] if key == 'month' else event[key]
+                arrival = f"{event['date']} {event['time']}"
+                late = event['status'] == 'Late'
+                row = totals.get(group)
+                if row is None:
+                    row = totals[group] = {key: group, 'name': event['name'] if key == 'employee_id' else '',
+                                           'present': 0, 'late': 0, 'minutes_late': 0,
+                                           'first_arrival': arrival, 'last_arrival': arrival}
+                row['late' if late else 'present'] += 1
+                row['minutes_late'] += event['minutes_late'] or 0
+                row['first_arrival'] = min(row['first_arrival'], arrival)
+                if arrival >= row['last_arrival']:
+                    row['last_arrival'] = arrival
+                    if key == 'employee_id':
+                        row['name'] = event['name']
+            
+            conn.executemany(f'''
+                INSERT INTO {table} ({key}, name, present, late, minutes_late, first_arrival, last_arrival)
+                VALUES (:{key}, :name, :present, :late, :minutes_late, :first_arrival, :last_arrival)
+                ON CONFLICT ({key}) DO UPDATE SET
+                    present = present + excluded.present,
+                    late = late + excluded.late,
+                    minutes_late = minutes_late + excluded.minutes_late,
+                    first_arrival = MIN(first_arrival, excluded.first_arrival),
+                    name = CASE WHEN excluded.last_arrival >= last_arrival THEN excluded.name ELSE name END,
+                    last_arrival = MAX(last_arrival, excluded.last_arrival)
+            ''', list(totals.values()))
+    
+    def rebuild_rollups(self):
+        """Recompute every rollup from attendance_events in one transaction."""
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                for table, key in ROLLUP_TABLES.items():
+                    group = "substr(date, 1, 7)" if key == 'month' else key
+                    name = "''"
+                    if key == 'employee_id':
+                        name = ('(SELECT latest.name FROM attendance_events latest '
+                                'WHERE latest.employee_id = events.employee_id '
+                                'ORDER BY latest.date DESC, latest.time DESC, latest.id DESC LIMIT 1)')
+                    conn.execute(f'DELETE FROM {table}')
+                    conn.execute(f'''
+                        INSERT INTO {table} ({key}, name, present, late, minutes_late, first_arrival, last_arrival)
+                        SELECT {group}, {name},
+                               SUM(status != 'Late'), SUM(status = 'Late'), SUM(minutes_late),
+                               MIN(date || ' ' || time), MAX(date || ' ' || time)
+                        FROM attendance_events events GROUP BY {group}
+                    ''')
+            return conn.execute('SELECT COUNT(*) FROM attendance_events').fetchone()[0]
+        finally:
+            conn.close()
+    
+    def rollup(self, kind, key):
+        """One rollup row as a dict, or None; kind is 'date', 'month' or 'employee_id'."""
+        table = next(name for name, column in ROLLUP_TABLES.items() if column == kind)
+        conn = self.connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute(f'SELECT * FROM {table} WHERE {kind} = ?', (key,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+    
+    def day_rollups(self, month):
+        """The day rollups of one month (at most 31 rows)."""
+        conn = self.connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in conn.execute(
+                'SELECT * FROM attendance_rollup_days WHERE date >= ? AND date < ? ORDER BY date',
+                (f'{month}-01', f'{month}-32'))]
+        finally:
+            conn.close()
+    
+    def run(self):
+        conn = self.connect()
+        failures = 0
+        retry = []
+        while True:
+            # A failed batch is retried ahead of anything queued since
+            batch = retry or [self.queue.get()]
+            retry = []
+            deadline = time.monotonic() + self.batch_window
+            
+            # A flush() sentinel ends the batch: everything queued before it
+            # is already here, and its caller is waiting on the commit.
+            while len(batch) < self.batch_size and not isinstance(batch[-1], threading.Event):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            events = [item for item in batch if isinstance(item, dict)]
+            waiters = [item for item in batch if isinstance(item, threading.Event)]
+            
+            if events:
+                try:
+                    with ATTENDANCE_WRITE_SECONDS.time():
+                        with conn:
+                            self.write_events(conn, events)
+                    ATTENDANCE_EVENTS_WRITTEN.inc(len(events))
+                    with self.dirty_lock:
+                        self.dirty_days.update(event['date'] for event in events)
+                    failures = 0
+                    self.last_error = None
+                except Exception as e:
+                    ATTENDANCE_WRITE_FAILURES.inc(stage='commit')
+                    failures += 1
+                    self.last_error = str(e)
+                    delay = min(0.5 * 2 ** (failures - 1), ATTENDANCE_RETRY_MAX_DELAY)
+                    print(f"Attendance log write failed ({failures}x), retrying in {delay:.1f}s: {str(e)}")
+                    # Events are always retried. Waiters stay behind them, so
+                    # flush() only returns once they are committed, until the
+                    # retries run out and it gets the error instead.
+                    retry = events
+                    for waiter in waiters:
+                        if failures >= ATTENDANCE_WRITE_RETRIES:
+                            waiter.error = self.last_error
+                            waiter.set()
+                        else:
+                            retry.append(waiter)
+                    time.sleep(delay)
+                    continue
+                
+                if self.on_commit is not None:
+                    try:
+                        self.on_commit(events)
+                    except Exception as e:
+                        print(f"Attendance commit hook failed: {str(e)}")
+            
+            for waiter in waiters:
+                waiter.set()
+    
+    def is_imported(self, day):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT 1 FROM imported_days WHERE date = ?', (day,)).fetchone() is not None
+        finally:
+            conn.close()
+    
+    def import_events(self, day, events):
+        conn = self.connect()
+        try:
+            with conn:
+                if conn.execute('SELECT 1 FROM imported_days WHERE date = ?', (day,)).fetchone():
+                    return False
+                self.write_events(conn, events)
+                conn.execute('INSERT INTO imported_days (date) VALUES (?)', (day,))
+            return True
+        finally:
+            conn.close()
+    
+    def imported_days(self):
+        conn = self.connect()
+        try:
+            return {row[0] for row in conn.execute('SELECT date FROM imported_days')}
+        finally:
+            conn.close()
+    
+    def query_events(self, start, end, employee_id=None):
+        """Yield events with start <= date < end (YYYY-MM-DD), oldest first."""
+        sql = ('SELECT date, time, employee_id, name, status, minutes_late FROM attendance_events '
+               'WHERE date >= ? AND date < ?')
+        params = [start, end]
+        if employee_id:
+            sql += ' AND employee_id = ?'
+            params.append(employee_id)
+        sql += ' ORDER BY date, time, id'
+        
+        conn = self.connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute(sql, params):
+                yield dict(row)
+        finally:
+            conn.close()
+    
+    def events_for_day(self, day):
+        next_day = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        return list(self.query_events(day, next_day))
+
+class AttendanceJournal:
+    """Today's attended employee IDs, backed by an append-only journal per day.
+    
+    add() claims an ID in memory; record() journals IDs once their attendance
+    events are committed, one fsync per committed batch, so a crash between
+    the two leaves the employee unmarked rather than marked with no row.
+    Startup replays the file, ignoring a torn last line from a crash. The set
+    rolls over by itself the first time it is touched after midnight.
+    Behaves like a set for readers.
+    """
+    
+    def __init__(self, journal_dir, keep_days=JOURNAL_KEEP_DAYS):
+        self.journal_dir = Path(journal_dir)
+        self.journal_dir.mkdir(exist_ok=True)
+        self.keep_days = keep_days
+        self.lock = threading.Lock()
+        self.day = None
+        self.attended = set()
+        self.file = None
+    
+    def journal_path(self, day):
+        return self.journal_dir / f"{day}.log"
+    
+    def replay(self, day):
+        attended = set()
+        path = self.journal_path(day)
+        if path.exists():
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.endswith('\n') and line.strip():
+                        attended.add(line.rstrip('\n'))
+        return attended
+    
+    def prune(self, today):
+        cutoff = (today - timedelta(days=self.keep_days)).strftime('%Y-%m-%d')
+        for path in self.journal_dir.glob('*.log'):
+            if path.stem < cutoff:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+    
+    def ensure_day(self):
+        today = date.today()
+        day = str(today)
+        if day == self.day:
+            return
+        
+        if self.file is not None:
+            self.file.close()
+        
+        self.attended = self.replay(day)
+        path = self.journal_path(day)
+        # A crash can leave a partial last line; start the next append on a fresh one
+        needs_newline = path.exists() and path.stat().st_size > 0 and not path.read_bytes().endswith(b'\n')
+        self.file = open(path, 'a', encoding='utf-8')
+        if needs_newline:
+            self.file.write('\n')
+        self.day = day
+        self.prune(today)
+    
+    def add(self, emp_id):
+        """Claim emp_id for today; False if it was already there."""
+        with self.lock:
+            self.ensure_day()
+            if emp_id in self.attended:
+                return False
+            self.attended.add(emp_id)
+            return True
+    
+    def record(self, day, emp_ids):
+        """Journal IDs whose attendance is committed; only today's journal is replayed."""
+        with self.lock:
+            self.ensure_day()
+            if day != self.day or not emp_ids:
+                return
+            self.file.write(''.join(f"{emp_id}\n" for emp_id in emp_ids))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.attended.update(emp_ids)
+    
+    def snapshot(self):
+        with self.lock:
+            self.ensure_day()
+            return set(self.attended)
+    
+    def state(self):
+        """(day, count): the set only grows within a day, so this identifies it."""
+        with self.lock:
+            self.ensure_day()
+            return self.day, len(self.attended)
+    
+    def __contains__(self, emp_id):
+        with self.lock:
+            self.ensure_day()
+            return emp_id in self.attended
+    
+    def __len__(self):
+        with self.lock:
+            self.ensure_day()
+            return len(self.attended)
+    
+    def __iter__(self):
+        return iter(self.snapshot())
+
+class EnrollmentSource:
+    """Photos (and possibly the manifest) for a bulk enrollment: a folder or a zip.
+    
+    Photos are looked up by the name given in the manifest, falling back to
+    the bare file name so archives with a top-level folder still work.
+    """
+    
+    def __init__(self, source):
+        self.archive = None
+        self.folder = None
+        self.names = {}
+        
+        if isinstance(source, (str, Path)) and os.path.isdir(source):
+            self.folder = os.path.realpath(source)
+            for root, _, files in os.walk(self.folder):
+                for filename in files:
+                    full = os.path.join(root, filename)
+                    self.names.setdefault(os.path.relpath(full, self.folder).replace(os.sep, '/'), full)
+                    self.names.setdefault(filename.lower(), full)
+        else:
+            self.archive = zipfile.ZipFile(source)
+            for info in self.archive.infolist():
+                if not info.is_dir():
+                    self.names.setdefault(info.filename, info.filename)
+                    self.names.setdefault(info.filename.rsplit('/', 1)[-1].lower(), info.filename)
+    
+    def resolve(self, name):
+        name = name.strip().replace('\\', '/')
+        return self.names.get(name) or self.names.get(name.rsplit('/', 1)[-1].lower())
+    
+    def read(self, name):
+        target = self.resolve(name)
+        if target is None:
+            return None
+        if self.archive is not None:
+            return self.archive.read(target)
+        with open(target, 'rb') as f:
+            return f.read()
+    
+    def manifest(self):
+        for name in ENROLLMENT_MANIFEST_NAMES:
+            data = self.read(name)
+            if data is not None:
+                return data.decode('utf-8-sig')
+        return None
+    
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
 
 class AttendanceSystem:
     def __init__(self):
@@ -40,18 +1354,44 @@ class AttendanceSystem:
         self.attendance_dir = self.base_dir / "attendance"
         self.registration_file = self.base_dir / "registration.csv"
         self.attendance_cache_file = self.base_dir / "attendance_cache.pkl"
+        self.attendance_journal_dir = self.base_dir / "attendance_journal"
         self.settings_file = self.base_dir / "settings.pkl"
         self.admin_file = self.base_dir / "admin.pkl"
+        self.face_index_file = self.base_dir / "face_index.npy"
+        self.face_index_manifest = self.base_dir / "face_index.json"
+        self.settings_lock = threading.RLock()
+        self.settings_cache = None
+        self.settings_cache_mtime = None
+        self.settings_checked_at = 0.0
+        self.attendance_db = self.base_dir / "attendance.db"
         
         self.photos_dir.mkdir(exist_ok=True)
         self.attendance_dir.mkdir(exist_ok=True)
         
-        cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        self.face_cascade = cv2.CascadeClassifier(cascade_path)
+        self.attendance_log = AttendanceLog(self.attendance_db)
+        self.workbook_lock = threading.Lock()
+        self.migrate_workbooks()
+        atexit.register(self.sync_workbooks)
+        threading.Thread(target=self.export_workbooks_loop, name='workbook-exporter', daemon=True).start()
+        
+        # A CascadeClassifier must not be shared between threads: camera
+        # workers, Flask request threads and the batch pool each get their own
+        self.cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        self.cascades = threading.local()
         
         self.known_face_data = []
         self.known_face_images = {}
-        self.today_attended = self.load_attendance_cache()
+        self.employee_index = {}
+        self.employees_version = time.time_ns()
+        self.gallery = FaceGallery()
+        self.gallery_lock = threading.RLock()
+        self.basis_fitted_size = 0
+        self.engine = None
+        self.trackers = {}
+        self.trackers_lock = threading.Lock()
+        self.today_attended = AttendanceJournal(self.attendance_journal_dir)
+        self.attendance_log.on_commit = self.journal_committed
+        self.migrate_attendance_cache()
         
         settings = self.load_settings()
         self.late_time = settings.get('late_time', '09:00')
@@ -76,21 +1416,16 @@ class AttendanceSystem:
             pass
         return set()
     
-    def save_attendance_cache(self):
+    def migrate_attendance_cache(self):
+        legacy = self.load_attendance_cache()
+        self.today_attended.record(str(date.today()), sorted(legacy))
         try:
-            cache = {'date': str(date.today()), 'attended': self.today_attended}
-            with open(self.attendance_cache_file, 'wb') as f:
-                pickle.dump(cache, f)
+            if self.attendance_cache_file.exists():
+                self.attendance_cache_file.unlink()
         except:
             pass
     
-    def load_settings(self):
-        try:
-            if self.settings_file.exists():
-                with open(self.settings_file, 'rb') as f:
-                    return pickle.load(f)
-        except:
-            pass
+    def default_settings(self):
         return {
             'late_time': '09:00', 
             'auto_start_time': '07:00', 
@@ -98,10 +1433,52 @@ class AttendanceSystem:
             'cctv_cameras': []
         }
     
+    def settings_mtime(self):
+        try:
+            return self.settings_file.stat().st_mtime_ns
+        except OSError:
+            return None
+    
+    def load_settings(self):
+        """Return a private copy of the cached settings.
+        
+        The file is only re-read when its mtime changed, and the mtime is only
+        checked every SETTINGS_RECHECK_INTERVAL seconds, so the per-request
+        callers (camera lists, streams) normally never touch the disk.
+        """
+        with self.settings_lock:
+            now = time.monotonic()
+            if self.settings_cache is None or now - self.settings_checked_at >= SETTINGS_RECHECK_INTERVAL:
+                self.settings_checked_at = now
+                mtime = self.settings_mtime()
+                if self.settings_cache is None or mtime != self.settings_cache_mtime:
+                    settings = self.default_settings()
+                    try:
+                        if mtime is not None:
+                            with open(self.settings_file, 'rb') as f:
+                                settings = pickle.load(f)
+                    except:
+                        pass
+                    self.settings_cache = settings
+                    self.settings_cache_mtime = mtime
+            return copy.deepcopy(self.settings_cache)
+    
     def save_settings(self, settings):
         try:
-            with open(self.settings_file, 'wb') as f:
-                pickle.dump(settings, f)
+            with self.settings_lock:
+                # Temp file + rename so readers (and other processes) only ever
+                # see a complete pickle
+                tmp_file = self.settings_file.with_name(self.settings_file.name + '.tmp')
+                with open(tmp_file, 'wb') as f:
+                    pickle.dump(settings, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.settings_file)
+                
+                self.settings_cache = copy.deepcopy(settings)
+                self.settings_cache_mtime = self.settings_mtime()
+                self.settings_checked_at = time.monotonic()
+            
             self.late_time = settings.get('late_time', self.late_time)
             self.auto_start_time = settings.get('auto_start_time', self.auto_start_time)
             self.auto_end_time = settings.get('auto_end_time', self.auto_end_time)
@@ -114,40 +1491,63 @@ class AttendanceSystem:
         return settings.get('cctv_cameras', [])
     
     def add_cctv_camera(self, name, url):
-        settings = self.load_settings()
-        cameras = settings.get('cctv_cameras', [])
-        
-        for cam in cameras:
-            if cam['name'] == name or cam['url'] == url:
-                return False
-        
-        camera_id = len(cameras) + 1
-        cameras.append({
-            'id': camera_id,
-            'name': name,
-            'url': url
-        })
-        
-        settings['cctv_cameras'] = cameras
-        self.save_settings(settings)
-        return True
+        with self.settings_lock:
+            settings = self.load_settings()
+            cameras = settings.get('cctv_cameras', [])
+            
+            for cam in cameras:
+                if cam['name'] == name or cam['url'] == url:
+                    return False
+            
+            camera_id = max((cam['id'] for cam in cameras), default=0) + 1
+            cameras.append({
+                'id': camera_id,
+                'name': name,
+                'url': url
+            })
+            
+            settings['cctv_cameras'] = cameras
+            self.save_settings(settings)
+            return True
     
     def remove_cctv_camera(self, camera_id):
-        settings = self.load_settings()
-        cameras = settings.get('cctv_cameras', [])
-        
-        if camera_id in camera_captures:
-            try:
-                camera_captures[camera_id].release()
-                del camera_captures[camera_id]
-            except:
-                pass
-        
-        cameras = [cam for cam in cameras if cam['id'] != camera_id]
+        stop_recognition_worker(camera_id)
+        stop_camera_reader(camera_id)
         
-        settings['cctv_cameras'] = cameras
-        self.save_settings(settings)
-        return True
+        with self.settings_lock:
+            settings = self.load_settings()
+            cameras = settings.get('cctv_cameras', [])
+            cameras = [cam for cam in cameras if cam['id'] != camera_id]
+            
+            settings['cctv_cameras'] = cameras
+            self.save_settings(settings)
+            return True
+    
+    def update_camera(self, camera_id, **fields):
+        with self.settings_lock:
+            settings = self.load_settings()
+            cameras = settings.get('cctv_cameras', [])
+            camera = next((cam for cam in cameras if cam['id'] == camera_id), None)
+            
+            if camera is None:
+                return None
+            
+            camera.update(fields)
+            settings['cctv_cameras'] = cameras
+            self.save_settings(settings)
+            return camera
+    
+    def set_camera_recognition(self, camera_id, enabled, fps=None):
+        fields = {'recognition': enabled}
+        if fps is not None:
+            fields['recognition_fps'] = fps
+        return self.update_camera(camera_id, **fields)
+    
+    def set_camera_motion_threshold(self, camera_id, threshold):
+        return self.update_camera(camera_id, motion_threshold=threshold)
+    
+    def set_camera_stream_profiles(self, camera_id, profiles):
+        return self.update_camera(camera_id, stream_profiles=profiles)
     
     def hash_password(self, password):
         return hashlib.sha256(password.encode()).hexdigest()
@@ -186,35 +1586,171 @@ class AttendanceSystem:
         
         return False, None
     
+    def load_face_index(self):
+        try:
+            if self.face_index_file.exists() and self.face_index_manifest.exists():
+                with open(self.face_index_manifest, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get('version') != FACE_INDEX_VERSION:
+                    raise ValueError('Incompatible face index')
+                
+                entries = manifest.get('entries', {})
+                if manifest.get('count', 0) == 0:
+                    templates = np.zeros((0,) + FACE_SIZE, dtype=np.uint8)
+                else:
+                    templates = np.load(self.face_index_file, mmap_mode='r')
+                
+                if templates.shape[1:] != FACE_SIZE or len(templates) != manifest.get('count', 0):
+                    raise ValueError('Incompatible face index')
+                if any(entry['row'] >= len(templates) for entry in entries.values()):
+                    raise ValueError('Face index manifest does not match templates')
+                return entries, templates
+        except Exception as e:
+            print(f"Face index unusable, rebuilding: {str(e)}")
+        return {}, np.zeros((0,) + FACE_SIZE, dtype=np.uint8)
+    
+    def save_face_index(self, entries, templates):
+        try:
+            stacked = np.stack(templates) if templates else np.zeros((0,) + FACE_SIZE, dtype=np.uint8)
+            manifest = {'version': FACE_INDEX_VERSION, 'count': len(stacked), 'entries': entries}
+            
+            # Write both files aside and swap them in, so a crash mid-save leaves
+            # either the old index or a mismatch that load_face_index rejects.
+            tmp_templates = self.face_index_file.with_name(self.face_index_file.name + '.tmp')
+            tmp_manifest = self.face_index_manifest.with_name(self.face_index_manifest.name + '.tmp')
+            with open(tmp_templates, 'wb') as f:
+                np.save(f, stacked)
+            with open(tmp_manifest, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_templates, self.face_index_file)
+            os.replace(tmp_manifest, self.face_index_manifest)
+        except Exception as e:
+            print(f"Failed to save face index: {str(e)}")
+    
+    def detect_face_template(self, photo_path):
+        img = cv2.imread(photo_path, cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None
+        faces = self.face_cascade().detectMultiScale(img, 1.1, 4)
+        if len(faces) == 0:
+            return None
+        x, y, w, h = faces[0]
+        face_roi = img[y:y+h, x:x+w]
+        return cv2.resize(face_roi, FACE_SIZE)
+    
     def load_employee_data(self):
         self.known_face_data = []
         self.known_face_images = {}
+        self.employee_index = {}
+        
+        cached_entries, cached_templates = self.load_face_index()
+        entries = {}
+        templates = []
+        detected = 0
         
         if self.registration_file.exists():
             try:
                 with open(self.registration_file, 'r', encoding='utf-8') as f:
                     reader = csv.DictReader(f)
                     for row in reader:
-                        self.known_face_data.append(row)
+                        self.index_employee(row)
                         
                         photo_path = row.get('Photo_Path', '')
-                        if os.path.exists(photo_path):
-                            img = cv2.imread(photo_path, cv2.IMREAD_GRAYSCALE)
-                            if img is not None:
-                                faces = self.face_cascade.detectMultiScale(img, 1.1, 4)
-                                if len(faces) > 0:
-                                    x, y, w, h = faces[0]
-                                    face_roi = img[y:y+h, x:x+w]
-                                    face_resized = cv2.resize(face_roi, (100, 100))
-                                    self.known_face_images[row['Employee_ID']] = face_resized
+                        if not os.path.exists(photo_path):
+                            continue
+                        
+                        stat = os.stat(photo_path)
+                        cached = cached_entries.get(photo_path)
+                        if photo_path in entries:
+                            entry = entries[photo_path]
+                            face_resized = templates[entry['row']] if entry['row'] >= 0 else None
+                        elif cached and cached['mtime_ns'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+                            face_resized = np.array(cached_templates[cached['row']]) if cached['row'] >= 0 else None
+                        else:
+                            face_resized = self.detect_face_template(photo_path)
+                            detected += 1
+                        
+                        if photo_path not in entries:
+                            entries[photo_path] = {
+                                'mtime_ns': stat.st_mtime_ns,
+                                'size': stat.st_size,
+                                'row': len(templates) if face_resized is not None else -1
+                            }
+                            if face_resized is not None:
+                                templates.append(face_resized)
+                        
+                        if face_resized is not None:
+                            self.known_face_images[row['Employee_ID']] = face_resized
             except:
                 pass
+        
+        # Rows were copied out above; drop the memmap so Windows lets
+        # save_face_index replace the file it maps.
+        del cached_templates
+        if detected or set(entries) != set(cached_entries):
+            self.save_face_index(entries, templates)
+        
+        self.employees_version = time.time_ns()
+        self.rebuild_gallery()
+    
+    def index_employee(self, emp_data):
+        """Append to known_face_data; the first row for an ID is the one looked up."""
+        self.employee_index.setdefault(emp_data['Employee_ID'], len(self.known_face_data))
+        self.known_face_data.append(emp_data)
+        self.employees_version = time.time_ns()
+    
+    def get_employee(self, emp_id):
+        position = self.employee_index.get(emp_id)
+        return self.known_face_data[position] if position is not None else None
+    
+    def build_gallery(self, known_face_data, known_face_images, basis=None):
+        if FACE_EMBEDDING_DIMS > 0 and len(known_face_images) > FACE_EMBEDDING_DIMS:
+            gallery = ProjectedGallery.from_employees(known_face_data, known_face_images,
+                                                      dims=FACE_EMBEDDING_DIMS, components=basis)
+        else:
+            gallery = FaceGallery.from_employees(known_face_data, known_face_images)
+        
+        if GALLERY_INDEX_CELLS > 0 and len(gallery) > GALLERY_INDEX_CELLS:
+            gallery.with_index(GALLERY_INDEX_CELLS, GALLERY_INDEX_PROBES)
+        return gallery
+    
+    def rebuild_gallery(self):
+        """Build a gallery of every employee and swap it in.
+        
+        The PCA fit and k-means training take seconds to minutes on large
+        galleries, so they run on a snapshot outside gallery_lock; employees
+        registered meanwhile are appended before the swap. The projection
+        basis is reused while the gallery has grown by less than
+        EMBEDDING_REFIT_GROWTH since it was fitted.
+        """
+        with self.gallery_lock:
+            source = self.known_face_data
+            known_face_data = list(source)
+            known_face_images = dict(self.known_face_images)
+            current = self.gallery
+        
+        basis = None
+        if (isinstance(current, ProjectedGallery) and len(current.components) == FACE_EMBEDDING_DIMS
+                and len(known_face_images) <= self.basis_fitted_size * (1 + EMBEDDING_REFIT_GROWTH)):
+            basis = current.components
+        gallery = self.build_gallery(known_face_data, known_face_images, basis)
+        
+        with self.gallery_lock:
+            if self.known_face_data is not source:
+                # Employees were reloaded meanwhile; that load swaps in its own gallery
+                return
+            if isinstance(gallery, ProjectedGallery) and basis is None:
+                self.basis_fitted_size = len(gallery)
+            for emp_data in source[len(known_face_data):]:
+                template = self.known_face_images.get(emp_data['Employee_ID'])
+                if template is not None and emp_data['Employee_ID'] not in gallery.ids:
+                    gallery = gallery.with_employee(emp_data, template)
+            self.set_gallery(gallery)
     
     def register_employee(self, emp_id, name, phone, address, image_data):
         try:
-            for emp in self.known_face_data:
-                if emp['Employee_ID'] == emp_id:
-                    return {'success': False, 'message': f'Employee ID {emp_id} already exists'}
+            if emp_id in self.employee_index:
+                return {'success': False, 'message': f'Employee ID {emp_id} already exists'}
             
             try:
                 if ',' in image_data:
@@ -237,7 +1773,7 @@ class AttendanceSystem:
                 return {'success': False, 'message': f'Invalid image: {str(e)}'}
             
             gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
-            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+            faces = self.face_cascade().detectMultiScale(gray, 1.1, 4)
             
             if len(faces) == 0:
                 return {'success': False, 'message': 'No face detected'}
@@ -246,53 +1782,278 @@ class AttendanceSystem:
             photo_path = self.photos_dir / photo_filename
             cv2.imwrite(str(photo_path), image_bgr)
             
-            x, y, w, h = faces[0]
-            face_roi = gray[y:y+h, x:x+w]
-            face_resized = cv2.resize(face_roi, (100, 100))
-            self.known_face_images[emp_id] = face_resized
+            x, y, w, h = faces[0]
+            face_roi = gray[y:y+h, x:x+w]
+            face_resized = cv2.resize(face_roi, FACE_SIZE)
+            self.known_face_images[emp_id] = face_resized
+            
+            with open(self.registration_file, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow([emp_id, name, phone, address, str(photo_path), datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
+            
+            emp_data = {
+                'Employee_ID': emp_id,
+                'Name': name,
+                'Phone': phone,
+                'Address': address,
+                'Photo_Path': str(photo_path)
+            }
+            self.index_employee(emp_data)
+            with self.gallery_lock:
+                self.set_gallery(self.gallery.with_employee(emp_data, face_resized))
+            
+            return {'success': True, 'message': 'Registration successful', 'emp_id': emp_id, 'name': name}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+    
+    def bulk_register(self, source, manifest_text=None):
+        """Enroll every row of a CSV manifest from a folder or zip of photos.
+        
+        Photos are decoded and face-detected in parallel, registration.csv and
+        the face index are each written once, and the gallery is swapped once.
+        Returns a summary and one report entry per manifest row.
+        """
+        source = source if isinstance(source, EnrollmentSource) else EnrollmentSource(source)
+        manifest_text = manifest_text if manifest_text is not None else source.manifest()
+        if manifest_text is None:
+            return {'success': False, 'message': 'No manifest found (expected manifest.csv)'}
+        
+        reader = csv.DictReader(io.StringIO(manifest_text))
+        columns = {field: ENROLLMENT_COLUMNS.get(field.strip().lower()) for field in (reader.fieldnames or [])}
+        if 'Employee_ID' not in columns.values() or 'Photo' not in columns.values():
+            return {'success': False, 'message': 'Manifest needs Employee_ID and Photo columns'}
+        
+        known_ids = self.employee_index
+        seen = set()
+        report = []
+        pending = []
+        for line, raw in enumerate(reader, start=2):
+            row = {'Employee_ID': '', 'Name': '', 'Phone': '', 'Address': '', 'Photo': ''}
+            for field, value in raw.items():
+                if columns.get(field):
+                    row[columns[field]] = (value or '').strip()
+            
+            entry = {'line': line, 'emp_id': row['Employee_ID'], 'photo': row['Photo']}
+            report.append(entry)
+            if not row['Employee_ID'] or not row['Name'] or not row['Photo']:
+                entry.update(status='invalid', message='Employee_ID, Name and Photo are required')
+            elif row['Employee_ID'] in known_ids:
+                entry.update(status='duplicate', message='Employee ID already registered')
+            elif row['Employee_ID'] in seen:
+                entry.update(status='duplicate', message='Employee ID repeated in manifest')
+            elif source.resolve(row['Photo']) is None:
+                entry.update(status='missing_photo', message='Photo not found')
+            else:
+                seen.add(row['Employee_ID'])
+                pending.append((entry, row))
+        
+        cascades = threading.local()
+        cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        
+        def enroll_photo(row):
+            image = cv2.imdecode(np.frombuffer(source.read(row['Photo']), dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                return 'unreadable_photo', None, None
+            if getattr(cascades, 'cascade', None) is None:
+                cascades.cascade = cv2.CascadeClassifier(cascade_path)
+            
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            faces = cascades.cascade.detectMultiScale(gray, 1.1, 4)
+            if len(faces) == 0:
+                return 'no_face', None, None
+            
+            photo_path = self.photos_dir / secure_filename(f"{row['Employee_ID']}_{row['Name'].replace(' ', '_')}.jpg")
+            cv2.imwrite(str(photo_path), image)
+            x, y, w, h = faces[0]
+            return 'registered', str(photo_path), cv2.resize(gray[y:y+h, x:x+w], FACE_SIZE)
+        
+        try:
+            with ThreadPoolExecutor(max_workers=BULK_ENROLL_WORKERS, thread_name_prefix='enroll') as pool:
+                outcomes = list(pool.map(enroll_photo, [row for _, row in pending]))
+        finally:
+            source.close()
+        
+        registered = []
+        for (entry, row), (status, photo_path, template) in zip(pending, outcomes):
+            entry['status'] = status
+            if status == 'no_face':
+                entry['message'] = 'No face detected'
+            elif status == 'unreadable_photo':
+                entry['message'] = 'Photo could not be decoded'
+            else:
+                entry['message'] = 'Registered'
+                registered.append(({
+                    'Employee_ID': row['Employee_ID'],
+                    'Name': row['Name'],
+                    'Phone': row['Phone'],
+                    'Address': row['Address'],
+                    'Photo_Path': photo_path
+                }, template))
+        
+        if registered:
+            registered_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            with self.gallery_lock:
+                with open(self.registration_file, 'a', newline='', encoding='utf-8') as f:
+                    csv.writer(f).writerows([[emp['Employee_ID'], emp['Name'], emp['Phone'], emp['Address'],
+                                              emp['Photo_Path'], registered_at] for emp, _ in registered])
+                
+                entries, cached_templates = self.load_face_index()
+                # Copy out of the memmap and drop it, or Windows refuses to
+                # let save_face_index replace the mapped file.
+                templates = list(np.array(cached_templates))
+                del cached_templates
+                for emp_data, template in registered:
+                    stat = os.stat(emp_data['Photo_Path'])
+                    entries[emp_data['Photo_Path']] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'row': len(templates)}
+                    templates.append(template)
+                    self.index_employee(emp_data)
+                    self.known_face_images[emp_data['Employee_ID']] = template
+                self.save_face_index(entries, templates)
+            
+            self.rebuild_gallery()
+        
+        counts = {}
+        for entry in report:
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        return {
+            'success': True,
+            'message': f"Registered {len(registered)} of {len(report)} employees",
+            'registered': len(registered),
+            'counts': counts,
+            'rows': report
+        }
+    
+    def workbook_path(self, day):
+        month_dir = self.attendance_dir / day[:7]
+        return month_dir / f"attendance_{day}.xlsx"
+    
+    def import_day_workbook(self, day):
+        """Pull rows from a workbook written before the event log existed."""
+        if self.attendance_log.is_imported(day):
+            return
+        
+        events = []
+        excel_file = self.workbook_path(day)
+        if excel_file.exists():
+            wb = load_workbook(excel_file, read_only=True)
+            for sheet_name in wb.sheetnames:
+                for row in wb[sheet_name].iter_rows(min_row=2, values_only=True):
+                    if row[0]:
+                        events.append({
+                            'date': str(row[0])[:10],
+                            'time': str(row[1]),
+                            'employee_id': str(row[2]),
+                            'name': str(row[3]),
+                            'status': row[4] or 'Present',
+                            'minutes_late': int(row[5]) if len(row) > 5 and row[5] else 0
+                        })
+            wb.close()
+        
+        self.attendance_log.import_events(day, events)
+    
+    def migrate_workbooks(self):
+        imported = self.attendance_log.imported_days()
+        pending = []
+        for excel_file in sorted(self.attendance_dir.glob('*/attendance_*.xlsx')):
+            day = excel_file.stem[len('attendance_'):]
+            try:
+                datetime.strptime(day, '%Y-%m-%d')
+            except ValueError:
+                continue
+            if day not in imported:
+                pending.append(day)
+        
+        if pending:
+            print(f"Migrating {len(pending)} attendance workbooks into {self.attendance_db.name}...")
+        for day in pending:
+            try:
+                self.import_day_workbook(day)
+            except Exception as e:
+                print(f"Failed to migrate attendance workbook for {day}: {str(e)}")
+    
+    def attendance_range(self, period, dt):
+        """Return the [start, end) date strings covering a day, month or year."""
+        if period == 'month':
+            start = dt.replace(day=1)
+            end = (start + timedelta(days=32)).replace(day=1)
+        elif period == 'year':
+            start = dt.replace(month=1, day=1)
+            end = start.replace(year=start.year + 1)
+        else:
+            start = dt
+            end = dt + timedelta(days=1)
+        return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    
+    def write_day_workbook(self, day):
+        with self.workbook_lock:
+            self.import_day_workbook(day)
+            events = self.attendance_log.events_for_day(day)
+            if not events:
+                return None
+            
+            wb = Workbook()
+            wb.remove(wb.active)
             
-            with open(self.registration_file, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([emp_id, name, phone, address, str(photo_path), datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
+            for event in events:
+                sheet_name = f"{event['employee_id']}_{event['name'][:20]}"
+                if sheet_name in wb.sheetnames:
+                    ws = wb[sheet_name]
+                else:
+                    ws = wb.create_sheet(sheet_name)
+                    headers = ['Date', 'Time', 'Employee ID', 'Name', 'Status', 'Minutes Late']
+                    ws.append(headers)
+                    for cell in ws[1]:
+                        cell.font = Font(bold=True, color="FFFFFF")
+                        cell.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+                        cell.alignment = Alignment(horizontal="center")
+                
+                ws.append([
+                    event['date'],
+                    event['time'],
+                    event['employee_id'],
+                    event['name'],
+                    event['status'],
+                    event['minutes_late'] if event['minutes_late'] > 0 else ''
+                ])
+                
+                if event['status'] == 'Late':
+                    for cell in ws[ws.max_row]:
+                        cell.fill = PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")
             
-            self.known_face_data.append({
-                'Employee_ID': emp_id,
-                'Name': name,
-                'Phone': phone,
-                'Address': address,
-                'Photo_Path': str(photo_path)
-            })
+            for ws in wb.worksheets:
+                for column in ws.columns:
+                    column = list(column)
+                    max_length = max(len(str(cell.value)) for cell in column if cell.value is not None)
+                    ws.column_dimensions[column[0].column_letter].width = max_length + 2
             
-            return {'success': True, 'message': 'Registration successful', 'emp_id': emp_id, 'name': name}
-        except Exception as e:
-            return {'success': False, 'message': str(e)}
+            excel_file = self.workbook_path(day)
+            excel_file.parent.mkdir(exist_ok=True)
+            tmp_file = excel_file.with_name(excel_file.name + '.tmp')
+            wb.save(tmp_file)
+            os.replace(tmp_file, excel_file)
+            return excel_file
+    
+    def sync_workbooks(self):
+        try:
+            self.attendance_log.flush()
+        except RuntimeError as e:
+            # Still export what is committed; the rest follows on a later sync
+            print(f"Syncing workbooks without a flush: {str(e)}")
+        for day in sorted(self.attendance_log.take_dirty_days()):
+            try:
+                self.write_day_workbook(day)
+            except Exception as e:
+                print(f"Failed to write attendance workbook for {day}: {str(e)}")
+    
+    def export_workbooks_loop(self):
+        while True:
+            time.sleep(WORKBOOK_EXPORT_INTERVAL)
+            self.sync_workbooks()
     
     def mark_attendance(self, emp_data, timestamp):
         try:
-            today = date.today()
-            year_month = today.strftime('%Y-%m')
-            month_dir = self.attendance_dir / year_month
-            month_dir.mkdir(exist_ok=True)
-            
-            excel_file = month_dir / f"attendance_{today.strftime('%Y-%m-%d')}.xlsx"
-            
-            if excel_file.exists():
-                wb = load_workbook(excel_file)
-            else:
-                wb = Workbook()
-                wb.remove(wb.active)
-            
-            sheet_name = f"{emp_data['Employee_ID']}_{emp_data['Name'][:20]}"
-            if sheet_name in wb.sheetnames:
-                ws = wb[sheet_name]
-            else:
-                ws = wb.create_sheet(sheet_name)
-                headers = ['Date', 'Time', 'Employee ID', 'Name', 'Status', 'Minutes Late']
-                ws.append(headers)
-                for cell in ws[1]:
-                    cell.font = Font(bold=True, color="FFFFFF")
-                    cell.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-                    cell.alignment = Alignment(horizontal="center")
+            today = timestamp.date()
+            day = today.strftime('%Y-%m-%d')
             
             arrival_time = timestamp.time()
             late_time_obj = datetime.strptime(self.late_time, '%H:%M').time()
@@ -306,35 +2067,20 @@ class AttendanceSystem:
                 minutes_late = int((arrival_dt - late_dt).total_seconds() / 60)
                 status = 'Late'
             
-            ws.append([
-                today.strftime('%Y-%m-%d'),
-                timestamp.strftime('%H:%M:%S'),
-                emp_data['Employee_ID'],
-                emp_data['Name'],
-                status,
-                minutes_late if minutes_late > 0 else ''
-            ])
-            
-            last_row = ws.max_row
-            if status == 'Late':
-                for cell in ws[last_row]:
-                    cell.fill = PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")
-            
-            for column in ws.columns:
-                max_length = 0
-                column = list(column)
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-                adjusted_width = (max_length + 2)
-                ws.column_dimensions[column[0].column_letter].width = adjusted_width
-            
-            wb.save(excel_file)
-            return str(excel_file), status, minutes_late
-        except:
+            # The event log is the record; the day's workbook is regenerated
+            # from it by the exporter thread or on demand.
+            self.attendance_log.append({
+                'date': day,
+                'time': timestamp.strftime('%H:%M:%S'),
+                'employee_id': emp_data['Employee_ID'],
+                'name': emp_data['Name'],
+                'status': status,
+                'minutes_late': minutes_late
+            })
+            return str(self.workbook_path(day)), status, minutes_late
+        except Exception as e:
+            ATTENDANCE_WRITE_FAILURES.inc(stage='mark')
+            print(f"mark_attendance failed: {str(e)}")
             return None, 'Error', 0
     
     def compare_faces(self, face1, face2):
@@ -353,58 +2099,225 @@ class AttendanceSystem:
         except:
             return 0.0
     
-    def process_frame(self, frame):
+    def face_cascade(self):
+        """This thread's own CascadeClassifier, loaded on first use."""
+        cascade = getattr(self.cascades, 'cascade', None)
+        if cascade is None:
+            cascade = self.cascades.cascade = cv2.CascadeClassifier(self.cascade_path)
+        return cascade
+    
+    def detect_faces(self, gray):
+        return self.face_cascade().detectMultiScale(gray, 1.1, 4, minSize=(50, 50))
+    
+    def detect_and_match(self, gray):
+        """Full-frame detection. Matches come back too when the engine scored them
+        in a worker process; in-process they are left to the caller (None)."""
+        engine = self.engine
+        if engine is not None:
+            try:
+                with FRAME_STAGE_SECONDS.time(stage='engine'):
+                    return engine.analyze(gray)
+            except Exception as e:
+                FRAME_ERRORS.inc(stage='engine')
+                print(f"Recognition engine failed, detecting in-process: {str(e)}")
+        with FRAME_STAGE_SECONDS.time(stage='detect'):
+            return [tuple(int(v) for v in box) for box in self.detect_faces(gray)], None
+    
+    def start_engine(self, workers):
+        if self.engine is not None or workers < 1:
+            return
+        cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        engine = RecognitionEngine(workers, cascade_path)
+        engine.publish(self.gallery)
+        self.engine = engine
+        atexit.register(engine.shutdown)
+    
+    def set_gallery(self, gallery):
+        with self.gallery_lock:
+            if self.engine is not None:
+                self.engine.publish(gallery)
+            self.gallery = gallery
+    
+    def face_crop(self, gray, box):
+        x, y, w, h = box
+        return cv2.resize(gray[y:y+h, x:x+w], FACE_SIZE)
+    
+    def journal_committed(self, events):
+        """AttendanceLog.on_commit: journal today's marks now that they are durable."""
+        by_day = {}
+        for event in events:
+            by_day.setdefault(event['date'], []).append(event['employee_id'])
+        for day, emp_ids in by_day.items():
+            self.today_attended.record(day, emp_ids)
+    
+    def record_match(self, emp_data):
+        """Mark attendance for a recognised employee; True if this call marked it."""
+        # add() is the atomic claim, so two threads seeing the same face at
+        # once can't both mark it
+        if not self.today_attended.add(emp_data['Employee_ID']):
+            return False
+        
+        with FRAME_STAGE_SECONDS.time(stage='mark'):
+            self.mark_attendance(emp_data, datetime.now())
+        return True
+    
+    def face_result(self, box, emp_data, attended, track_id=None):
+        x, y, w, h = (int(v) for v in box)
+        emp_id = emp_data['Employee_ID'] if emp_data else None
+        result = {
+            'name': emp_data['Name'] if emp_data else "Unknown",
+            'emp_id': emp_id,
+            'box': {'top': y, 'right': x+w, 'bottom': y+h, 'left': x},
+            'attended': attended,
+            'already_attended': emp_id in self.today_attended if emp_id else False
+        }
+        if track_id is not None:
+            result['track_id'] = track_id
+        return result
+    
+    def get_tracker(self, source):
+        now = time.monotonic()
+        with self.trackers_lock:
+            for key in [key for key, t in self.trackers.items() if now - t.last_used > TRACKER_IDLE_TIMEOUT]:
+                del self.trackers[key]
+            
+            tracker = self.trackers.get(source)
+            if tracker is None:
+                tracker = FaceTracker()
+                self.trackers[source] = tracker
+            tracker.last_used = now
+            return tracker
+    
+    def motion_stats(self):
+        with self.trackers_lock:
+            return {source: tracker.motion.stats() for source, tracker in self.trackers.items()}
+    
+    def process_frame(self, frame, source=None, motion_threshold=MOTION_DEFAULT_THRESHOLD):
         results = []
         
         try:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = self.face_cascade.detectMultiScale(gray, 1.1, 4, minSize=(50, 50))
+            gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             
-            for (x, y, w, h) in faces:
-                face_roi = gray[y:y+h, x:x+w]
-                face_resized = cv2.resize(face_roi, (100, 100))
-                
-                name = "Unknown"
-                emp_id = None
+            if source is not None:
+                tracker = self.get_tracker(source)
+                with tracker.lock:
+                    return tracker.update(self, gray, motion_threshold)
+            
+            faces, matches = self.detect_and_match(gray)
+            if matches is None:
+                with FRAME_STAGE_SECONDS.time(stage='match'):
+                    matches = self.gallery.match([self.face_crop(gray, box) for box in faces])
+            
+            for box, (best_match_emp, best_match_score) in zip(faces, matches):
+                emp_data = None
                 attended = False
-                best_match_score = 0
-                best_match_emp = None
                 
-                for emp_data in self.known_face_data:
-                    emp_id_check = emp_data['Employee_ID']
-                    
-                    if emp_id_check in self.known_face_images:
-                        stored_face = self.known_face_images[emp_id_check]
-                        score = self.compare_faces(stored_face, face_resized)
-                        
-                        if score > best_match_score:
-                            best_match_score = score
-                            best_match_emp = emp_data
+                if best_match_emp is not None and best_match_score > MATCH_THRESHOLD:
+                    emp_data = best_match_emp
+                    attended = self.record_match(emp_data)
                 
-                if best_match_score > 0.65:
-                    name = best_match_emp['Name']
-                    emp_id = best_match_emp['Employee_ID']
-                    
-                    if emp_id not in self.today_attended:
-                        timestamp = datetime.now()
-                        self.mark_attendance(best_match_emp, timestamp)
-                        self.today_attended.add(emp_id)
-                        self.save_attendance_cache()
-                        attended = True
+                results.append(self.face_result(box, emp_data, attended))
+        except Exception as e:
+            FRAME_ERRORS.inc(stage='process_frame')
+            print(f"process_frame failed: {str(e)}")
+        
+        return results
+
+    def process_frames(self, jpegs):
+        """Recognise a batch of frames keyed by source ID.
+        
+        Frames are decoded and detected in parallel, then every face that still
+        needs scoring is matched against the gallery in one pass. Attendance
+        goes through record_match exactly like process_frame.
+        """
+        def decode_and_detect(image_bytes):
+            with FRAME_STAGE_SECONDS.time(stage='decode'):
+                gray = decode_gray(image_bytes)
+            if gray is None:
+                return None
+            boxes, matches = self.detect_and_match(gray)
+            return gray, boxes, matches
+        
+        sources = list(jpegs)
+        detected = dict(zip(sources, batch_pool.map(decode_and_detect, [jpegs[src] for src in sources])))
+        
+        crops, owners = [], []
+        for source, item in detected.items():
+            if item is not None and item[2] is None:
+                gray, boxes, _ = item
+                for index, box in enumerate(boxes):
+                    crops.append(self.face_crop(gray, box))
+                    owners.append((source, index))
+        
+        pooled = {}
+        if crops:
+            with FRAME_STAGE_SECONDS.time(stage='match'):
+                for owner, match in zip(owners, self.gallery.match(crops)):
+                    pooled[owner] = match
+        
+        results = {}
+        for source, item in detected.items():
+            if item is None:
+                FRAME_ERRORS.inc(stage='decode')
+                results[source] = {'success': False, 'message': 'Processing failed'}
+                continue
+            
+            _, boxes, matches = item
+            faces = []
+            for index, box in enumerate(boxes):
+                best_match_emp, best_match_score = matches[index] if matches is not None else pooled[(source, index)]
+                emp_data = None
+                attended = False
                 
-                results.append({
-                    'name': name,
-                    'emp_id': emp_id,
-                    'box': {'top': y, 'right': x+w, 'bottom': y+h, 'left': x},
-                    'attended': attended,
-                    'already_attended': emp_id in self.today_attended if emp_id else False
-                })
-        except:
-            pass
+                if best_match_emp is not None and best_match_score > MATCH_THRESHOLD:
+                    emp_data = best_match_emp
+                    attended = self.record_match(emp_data)
+                
+                faces.append(self.face_result(box, emp_data, attended))
+            results[source] = {'success': True, 'faces': faces}
         
         return results
 
-system = AttendanceSystem()
+# Spawned recognition engine workers re-import this file as __mp_main__; they
+# only need recognition_engine, not a second AttendanceSystem and its threads.
+if __name__ != '__mp_main__':
+    system = AttendanceSystem()
+
+def start_recognition_worker(camera):
+    fps = camera.get('recognition_fps', DEFAULT_RECOGNITION_FPS)
+    
+    with recognition_workers_lock:
+        worker = recognition_workers.get(camera['id'])
+        if worker is not None and worker.is_alive():
+            worker.stop()
+        
+        worker = CameraRecognitionWorker(system, camera, fps)
+        recognition_workers[camera['id']] = worker
+        worker.start()
+    return worker
+
+def stop_recognition_worker(camera_id):
+    with recognition_workers_lock:
+        worker = recognition_workers.pop(camera_id, None)
+    
+    if worker is not None:
+        worker.stop()
+        return True
+    return False
+
+def start_background_services():
+    """Recognition engine and enabled camera workers; once per serving process."""
+    engine_workers = int(os.environ.get('RECOGNITION_WORKERS', '0'))
+    if engine_workers > 0:
+        print(f"Recognition engine: {engine_workers} worker processes")
+        system.start_engine(engine_workers)
+    start_enabled_recognition_workers()
+
+def start_enabled_recognition_workers():
+    for camera in system.get_cctv_cameras():
+        if camera.get('recognition'):
+            print(f"Starting server-side recognition for camera: {camera['name']}")
+            start_recognition_worker(camera)
 
 @app.route('/')
 def index():
@@ -490,60 +2403,266 @@ def register():
     except:
         return jsonify({'success': False, 'message': 'Registration failed'}), 500
 
+@app.route('/api/register/bulk', methods=['POST'])
+def register_bulk():
+    """Zip of photos as 'archive', manifest CSV as 'manifest' or inside the zip."""
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    archive = request.files.get('archive')
+    if archive is None:
+        return jsonify({'success': False, 'message': 'No archive uploaded'}), 400
+    
+    try:
+        manifest = request.files.get('manifest')
+        manifest_text = manifest.read().decode('utf-8-sig') if manifest else None
+        result = system.bulk_register(EnrollmentSource(archive.stream), manifest_text)
+        return jsonify(result), 200 if result['success'] else 400
+    except zipfile.BadZipFile:
+        return jsonify({'success': False, 'message': 'Archive is not a zip file'}), 400
+    except Exception as e:
+        print(f"Bulk registration failed: {str(e)}")
+        return jsonify({'success': False, 'message': 'Bulk registration failed'}), 500
+
+def cached_json(etag, build):
+    """jsonify(build()), or an empty 304 if the client already holds this ETag."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def listing_etag(*state):
+    # The query string is part of the tag so each page/filter validates on its own
+    return hashlib.sha1(repr(state + (request.query_string,)).encode()).hexdigest()
+
+def paginate_employees(positions, known_face_data):
+    """Filter and page employees given their positions in known_face_data.
+    
+    ?q= matches ID, name or phone (case-insensitive); ?limit= and ?cursor=
+    page through the result, the cursor being the last Employee_ID returned.
+    Without a limit everything is returned, as before.
+    """
+    query = request.args.get('q', '').strip().lower()
+    if query:
+        positions = [p for p in positions
+                     if any(query in str(known_face_data[p].get(field) or '').lower()
+                            for field in ('Employee_ID', 'Name', 'Phone'))]
+    
+    cursor = request.args.get('cursor')
+    start = 0
+    if cursor and cursor in system.employee_index:
+        start = bisect.bisect_right(positions, system.employee_index[cursor])
+    
+    limit = request.args.get('limit', type=int)
+    page = positions[start:start + limit] if limit and limit > 0 else positions[start:]
+    more = start + len(page) < len(positions)
+    
+    return {
+        'employees': [known_face_data[p] for p in page],
+        'count': len(positions),
+        'next_cursor': known_face_data[page[-1]]['Employee_ID'] if page and more else None
+    }
+
 @app.route('/api/employees', methods=['GET'])
 def get_employees():
     if 'admin_logged_in' not in session:
         return jsonify({'employees': [], 'count': 0}), 401
     
-    employees = system.known_face_data
-    return jsonify({'employees': employees, 'count': len(employees)})
+    known_face_data = system.known_face_data
+    return cached_json(listing_etag(system.employees_version, len(known_face_data)),
+                       lambda: paginate_employees(range(len(known_face_data)), known_face_data))
+
+class FrameSlot:
+    """Latest-frame-wins admission for one client or camera.
+    
+    One frame runs at a time. A frame that arrives while one is running waits
+    in the single pending place; if a newer frame takes that place first, the
+    older one is dropped. Queue depth per source is therefore at most one.
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.busy = False
+        self.pending = None
+        self.average_seconds = None
+        self.last_used = time.monotonic()
+    
+    def acquire(self):
+        token = object()
+        with self.condition:
+            self.last_used = time.monotonic()
+            if self.busy:
+                if self.pending is not None:
+                    self.condition.notify_all()
+                self.pending = token
+                self.condition.wait_for(lambda: self.pending is not token or not self.busy)
+                if self.pending is not token:
+                    return False
+                self.pending = None
+            self.busy = True
+            return True
+    
+    def release(self, elapsed):
+        with self.condition:
+            if self.average_seconds is None:
+                self.average_seconds = elapsed
+            else:
+                self.average_seconds = 0.8 * self.average_seconds + 0.2 * elapsed
+            self.busy = False
+            self.condition.notify_all()
+
+def get_frame_slot(source):
+    now = time.monotonic()
+    with frame_slots_lock:
+        for key in [key for key, slot in frame_slots.items()
+                    if not slot.busy and now - slot.last_used > TRACKER_IDLE_TIMEOUT]:
+            del frame_slots[key]
+        
+        slot = frame_slots.get(source)
+        if slot is None:
+            slot = frame_slots[source] = FrameSlot()
+        return slot
+
+def next_interval_hint(slot):
+    """Suggested wait before the next frame: this source's recent processing
+    time, stretched by how many sources are competing for the CPU right now."""
+    with frame_slots_lock:
+        busy = sum(1 for other in frame_slots.values() if other.busy)
+    average = slot.average_seconds or FRAME_HINT_MIN_MS / 1000
+    hint = average * 1000 * max(1, busy) * 1.2
+    return int(min(FRAME_HINT_MAX_MS, max(FRAME_HINT_MIN_MS, hint)))
+
+def read_frame_bytes():
+    """Return the JPEG bytes of a posted frame: raw body, multipart or legacy base64 JSON."""
+    if request.mimetype in ('image/jpeg', 'application/octet-stream'):
+        return request.get_data(cache=False)
+    
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('frame')
+        return upload.read() if upload else None
+    
+    data = request.json
+    image_data = data['frame']
+    if ',' in image_data:
+        return base64.b64decode(image_data.split(',')[1])
+    return base64.b64decode(image_data)
 
 @app.route('/api/process-frame', methods=['POST'])
 def process_frame():
+    source = request.args.get('source') or request.headers.get('X-Frame-Source')
+    slot = get_frame_slot(f"client-{source}" if source else f"addr-{request.remote_addr}")
+    
+    # Read the body before queueing so a superseded request frees its socket fast
     try:
-        data = request.json
-        image_data = data['frame']
+        with FRAME_STAGE_SECONDS.time(stage='read'):
+            image_bytes = read_frame_bytes()
+    except Exception as e:
+        FRAME_ERRORS.inc(stage='read')
+        print(f"/api/process-frame failed: {str(e)}")
+        return jsonify({'success': False, 'message': 'Processing failed'})
+    
+    if not slot.acquire():
+        FRAMES_SKIPPED.inc(reason='superseded')
+        return jsonify({'success': True, 'faces': [], 'dropped': True,
+                        'next_interval_ms': next_interval_hint(slot)})
+    
+    started = time.perf_counter()
+    try:
+        if not image_bytes:
+            FRAME_ERRORS.inc(stage='read')
+            return jsonify({'success': False, 'message': 'Processing failed'})
         
-        if ',' in image_data:
-            image_bytes = base64.b64decode(image_data.split(',')[1])
-        else:
-            image_bytes = base64.b64decode(image_data)
-            
-        image = Image.open(io.BytesIO(image_bytes))
-        frame = np.array(image)
+        with FRAME_STAGE_SECONDS.time(stage='decode'):
+            gray = decode_gray(image_bytes)
+        if gray is None:
+            FRAME_ERRORS.inc(stage='decode')
+            return jsonify({'success': False, 'message': 'Processing failed'})
+        
+        camera_id = request.args.get('camera', type=int)
         
-        if len(frame.shape) == 3 and frame.shape[2] == 3:
-            frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        threshold = MOTION_DEFAULT_THRESHOLD
+        if camera_id is not None:
+            camera = next((cam for cam in system.get_cctv_cameras() if cam['id'] == camera_id), None)
+            if camera:
+                threshold = camera.get('motion_threshold', MOTION_DEFAULT_THRESHOLD)
+        
+        with FRAME_STAGE_SECONDS.time(stage='process_frame'):
+            results = system.process_frame(gray, f"client-{source}" if source else None, threshold)
+        slot.release(time.perf_counter() - started)
+        started = None
+        return jsonify({'success': True, 'faces': results, 'next_interval_ms': next_interval_hint(slot)})
+    except Exception as e:
+        FRAME_ERRORS.inc(stage='request')
+        print(f"/api/process-frame failed: {str(e)}")
+        return jsonify({'success': False, 'message': 'Processing failed'})
+    finally:
+        if started is not None:
+            slot.release(time.perf_counter() - started)
+
+@app.route('/api/process-frames', methods=['POST'])
+def process_frames():
+    """Batch of frames in one request, for multi-camera clients.
+    
+    Multipart: one JPEG file per frame, the form field name being its source
+    ID. JSON: {"frames": [{"source": ..., "frame": <base64 JPEG>}, ...]}.
+    """
+    try:
+        jpegs = {}
+        if request.mimetype == 'multipart/form-data':
+            for source, upload in request.files.items(multi=True):
+                jpegs[source] = upload.read()
         else:
-            frame_bgr = frame
+            for item in (request.json or {}).get('frames', []):
+                image_data = item['frame']
+                if ',' in image_data:
+                    image_data = image_data.split(',')[1]
+                jpegs[str(item['source'])] = base64.b64decode(image_data)
         
-        results = system.process_frame(frame_bgr)
-        return jsonify({'success': True, 'faces': results})
-    except:
+        if not jpegs:
+            return jsonify({'success': False, 'message': 'No frames'})
+        if len(jpegs) > MAX_BATCH_FRAMES:
+            return jsonify({'success': False, 'message': f'At most {MAX_BATCH_FRAMES} frames per batch'}), 413
+        
+        with FRAME_STAGE_SECONDS.time(stage='process_frames'):
+            results = system.process_frames(jpegs)
+        return jsonify({'success': True, 'sources': results})
+    except Exception as e:
+        FRAME_ERRORS.inc(stage='batch_request')
+        print(f"/api/process-frames failed: {str(e)}")
         return jsonify({'success': False, 'message': 'Processing failed'})
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/attendance-today', methods=['GET'])
 def attendance_today():
     if 'admin_logged_in' not in session:
         return jsonify({'count': 0, 'employees': []}), 401
     
-    attended_ids = list(system.today_attended)
-    attended_employees = []
+    day, attended = system.today_attended.state()
+    known_face_data = system.known_face_data
     
-    for emp_data in system.known_face_data:
-        if emp_data['Employee_ID'] in attended_ids:
-            attended_employees.append(emp_data)
+    def build():
+        positions = sorted(system.employee_index[emp_id] for emp_id in system.today_attended.snapshot()
+                           if emp_id in system.employee_index)
+        result = paginate_employees(positions, known_face_data)
+        result['date'] = day
+        return result
     
-    return jsonify({
-        'count': len(attended_employees),
-        'employees': attended_employees,
-        'date': str(date.today())
-    })
+    return cached_json(listing_etag(day, attended, system.employees_version, len(known_face_data)), build)
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     total_employees = len(system.known_face_data)
     today_attendance = len(system.today_attended)
+    today_rollup = system.attendance_log.rollup('date', str(date.today())) or {'late': 0, 'minutes_late': 0}
     attendance_rate = (today_attendance / total_employees * 100) if total_employees > 0 else 0
     
     current_time = datetime.now().time()
@@ -555,86 +2674,104 @@ def get_stats():
         'total_employees': total_employees,
         'today_attendance': today_attendance,
         'attendance_rate': round(attendance_rate, 1),
+        'today_late': today_rollup['late'],
+        'today_minutes_late': today_rollup['minutes_late'],
         'date': str(date.today()),
         'within_hours': within_hours,
         'operating_hours': f"{system.auto_start_time} - {system.auto_end_time}"
     })
 
+def rollup_report(kind, key):
+    row = system.attendance_log.rollup(kind, key) or {
+        kind: key, 'name': '', 'present': 0, 'late': 0, 'minutes_late': 0,
+        'first_arrival': None, 'last_arrival': None
+    }
+    row['total'] = row['present'] + row['late']
+    if kind != 'employee_id':
+        del row['name']
+    return row
+
+@app.route('/api/reports/day', methods=['GET'])
+def report_day():
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    day = request.args.get('date', str(date.today()))
+    try:
+        datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'date must be YYYY-MM-DD'}), 400
+    return jsonify({'success': True, 'report': rollup_report('date', day)})
+
+@app.route('/api/reports/month', methods=['GET'])
+def report_month():
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    month = request.args.get('month', date.today().strftime('%Y-%m'))
+    try:
+        datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'month must be YYYY-MM'}), 400
+    
+    days = system.attendance_log.day_rollups(month)
+    for row in days:
+        row['total'] = row['present'] + row['late']
+        del row['name']
+    return jsonify({'success': True, 'report': rollup_report('month', month), 'days': days})
+
+@app.route('/api/reports/employee/<emp_id>', methods=['GET'])
+def report_employee(emp_id):
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    report = rollup_report('employee_id', emp_id)
+    emp = system.get_employee(emp_id)
+    if emp is not None:
+        report['name'] = emp['Name']
+    elif report['total'] == 0:
+        return jsonify({'success': False, 'message': 'Employee not found'}), 404
+    return jsonify({'success': True, 'report': report})
+
+@app.route('/api/reports/rebuild', methods=['POST'])
+def rebuild_reports():
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        system.attendance_log.flush()
+        events = system.attendance_log.rebuild_rollups()
+        return jsonify({'success': True, 'message': f'Rollups rebuilt from {events} events'})
+    except Exception as e:
+        print(f"Rollup rebuild failed: {str(e)}")
+        return jsonify({'success': False, 'message': 'Rebuild failed'}), 500
+
 @app.route('/api/download-csv', methods=['POST'])
 def download_csv():
     if 'admin_logged_in' not in session:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 401
     
     try:
+        system.attendance_log.flush()
+        
         data = request.json
         download_type = data.get('type', 'day')
         selected_date = data.get('date', str(date.today()))
         
         try:
-            dt = datetime.strptime(selected_date, '%Y-%m-%d')
+            dt = datetime.strptime(selected_date, '%Y-%m-%d').date()
         except:
             dt = date.today()
         
         csv_data = []
         csv_data.append(['Date', 'Time', 'Employee ID', 'Name', 'Phone', 'Status', 'Minutes Late'])
         
-        if download_type == 'day':
-            year_month = dt.strftime('%Y-%m')
-            month_dir = system.attendance_dir / year_month
-            excel_file = month_dir / f"attendance_{dt.strftime('%Y-%m-%d')}.xlsx"
-            
-            if excel_file.exists():
-                wb = load_workbook(excel_file)
-                for sheet_name in wb.sheetnames:
-                    ws = wb[sheet_name]
-                    for row in ws.iter_rows(min_row=2, values_only=True):
-                        if row[0]:
-                            emp_id = row[2]
-                            phone = ''
-                            for emp in system.known_face_data:
-                                if emp['Employee_ID'] == emp_id:
-                                    phone = emp.get('Phone', '')
-                                    break
-                            minutes_late = row[5] if len(row) > 5 else ''
-                            csv_data.append([row[0], row[1], row[2], row[3], phone, row[4], minutes_late])
-        
-        elif download_type == 'month':
-            year_month = dt.strftime('%Y-%m')
-            month_dir = system.attendance_dir / year_month
-            
-            if month_dir.exists():
-                for excel_file in sorted(month_dir.glob('attendance_*.xlsx')):
-                    wb = load_workbook(excel_file)
-                    for sheet_name in wb.sheetnames:
-                        ws = wb[sheet_name]
-                        for row in ws.iter_rows(min_row=2, values_only=True):
-                            if row[0]:
-                                emp_id = row[2]
-                                phone = ''
-                                for emp in system.known_face_data:
-                                    if emp['Employee_ID'] == emp_id:
-                                        phone = emp.get('Phone', '')
-                                        break
-                                minutes_late = row[5] if len(row) > 5 else ''
-                                csv_data.append([row[0], row[1], row[2], row[3], phone, row[4], minutes_late])
-        
-        elif download_type == 'year':
-            year = dt.strftime('%Y')
-            for month_dir in sorted(system.attendance_dir.glob(f'{year}-*')):
-                for excel_file in sorted(month_dir.glob('attendance_*.xlsx')):
-                    wb = load_workbook(excel_file)
-                    for sheet_name in wb.sheetnames:
-                        ws = wb[sheet_name]
-                        for row in ws.iter_rows(min_row=2, values_only=True):
-                            if row[0]:
-                                emp_id = row[2]
-                                phone = ''
-                                for emp in system.known_face_data:
-                                    if emp['Employee_ID'] == emp_id:
-                                        phone = emp.get('Phone', '')
-                                        break
-                                minutes_late = row[5] if len(row) > 5 else ''
-                                csv_data.append([row[0], row[1], row[2], row[3], phone, row[4], minutes_late])
+        start, end = system.attendance_range(download_type, dt)
+        for event in system.attendance_log.query_events(start, end):
+            minutes_late = event['minutes_late'] if event['minutes_late'] > 0 else ''
+            emp = system.get_employee(event['employee_id'])
+            csv_data.append([event['date'], event['time'], event['employee_id'], event['name'],
+                             emp.get('Phone', '') if emp else '', event['status'], minutes_late])
         
         import io as csv_io
         output = csv_io.StringIO()
@@ -658,6 +2795,92 @@ def download_csv():
     except:
         return jsonify({'success': False, 'message': 'Download failed'})
 
+@app.route('/api/export/attendance.csv', methods=['GET'])
+def export_attendance_csv():
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    download_type = request.args.get('type', 'day')
+    selected_date = request.args.get('date', str(date.today()))
+    emp_id = request.args.get('emp_id', '').strip() or None
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    try:
+        dt = datetime.strptime(selected_date, '%Y-%m-%d').date()
+    except:
+        dt = date.today()
+    
+    if download_type == 'month':
+        filename = f"attendance_{dt.strftime('%Y-%m')}"
+    elif download_type == 'year':
+        filename = f"attendance_{dt.strftime('%Y')}"
+    else:
+        filename = f"attendance_{dt.strftime('%Y-%m-%d')}"
+    if emp_id:
+        filename += f"_{secure_filename(emp_id)}"
+    filename += '.csv.gz' if use_gzip else '.csv'
+    
+    try:
+        system.attendance_log.flush()
+    except RuntimeError as e:
+        print(f"Export failed: {str(e)}")
+        return jsonify({'success': False, 'message': 'Attendance log unavailable, try again shortly'}), 503
+    start, end = system.attendance_range(download_type, dt)
+    events = system.attendance_log.query_events(start, end, emp_id)
+    def generate_rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None
+        
+        def drain():
+            chunk = buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            return compressor.compress(chunk) if compressor else chunk
+        
+        writer.writerow(['Date', 'Time', 'Employee ID', 'Name', 'Phone', 'Status', 'Minutes Late'])
+        for event in events:
+            minutes_late = event['minutes_late'] if event['minutes_late'] > 0 else ''
+            emp = system.get_employee(event['employee_id'])
+            writer.writerow([event['date'], event['time'], event['employee_id'], event['name'],
+                             emp.get('Phone', '') if emp else '', event['status'], minutes_late])
+            if buffer.tell() >= CSV_STREAM_CHUNK_SIZE:
+                chunk = drain()
+                if chunk:
+                    yield chunk
+        
+        chunk = drain()
+        if compressor:
+            chunk += compressor.flush()
+        if chunk:
+            yield chunk
+    
+    return Response(generate_rows(),
+                    mimetype='application/gzip' if use_gzip else 'text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/attendance-workbook', methods=['GET'])
+def download_attendance_workbook():
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    selected_date = request.args.get('date', str(date.today()))
+    try:
+        day = datetime.strptime(selected_date, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except:
+        return jsonify({'success': False, 'message': 'Invalid date'}), 400
+    
+    try:
+        system.attendance_log.flush()
+    except RuntimeError as e:
+        print(f"Workbook download failed: {str(e)}")
+        return jsonify({'success': False, 'message': 'Attendance log unavailable, try again shortly'}), 503
+    excel_file = system.write_day_workbook(day)
+    if excel_file is None:
+        return jsonify({'success': False, 'message': 'No attendance for this date'}), 404
+    
+    return send_file(excel_file, as_attachment=True, download_name=excel_file.name)
+
 @app.route('/api/settings', methods=['GET'])
 def get_settings():
     if 'admin_logged_in' not in session:
@@ -677,16 +2900,17 @@ def update_settings():
     
     try:
         data = request.json
-        current_settings = system.load_settings()
         
-        settings = {
-            'late_time': data.get('late_time', system.late_time),
-            'auto_start_time': data.get('auto_start_time', system.auto_start_time),
-            'auto_end_time': data.get('auto_end_time', system.auto_end_time),
-            'cctv_cameras': current_settings.get('cctv_cameras', [])
-        }
+        with system.settings_lock:
+            settings = system.load_settings()
+            settings.update({
+                'late_time': data.get('late_time', system.late_time),
+                'auto_start_time': data.get('auto_start_time', system.auto_start_time),
+                'auto_end_time': data.get('auto_end_time', system.auto_end_time)
+            })
+            saved = system.save_settings(settings)
         
-        if system.save_settings(settings):
+        if saved:
             return jsonify({
                 'success': True,
                 'message': 'Settings updated',
@@ -752,6 +2976,135 @@ def remove_cctv_camera(camera_id):
     except:
         return jsonify({'success': False, 'message': 'Failed to remove camera'})
 
+@app.route('/api/cctv-cameras/<int:camera_id>/recognition/start', methods=['POST'])
+def start_camera_recognition(camera_id):
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        fps = float(data.get('fps', DEFAULT_RECOGNITION_FPS))
+        if not 0 < fps <= MAX_RECOGNITION_FPS:
+            return jsonify({'success': False, 'message': f'FPS must be between 0 and {MAX_RECOGNITION_FPS:g}'})
+        
+        camera = system.set_camera_recognition(camera_id, True, fps)
+        if camera is None:
+            return jsonify({'success': False, 'message': 'Camera not found'}), 404
+        
+        worker = start_recognition_worker(camera)
+        return jsonify({'success': True, 'message': 'Recognition started', 'status': worker.status()})
+    except:
+        return jsonify({'success': False, 'message': 'Failed to start recognition'})
+
+@app.route('/api/cctv-cameras/<int:camera_id>/recognition/stop', methods=['POST'])
+def stop_camera_recognition(camera_id):
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        if system.set_camera_recognition(camera_id, False) is None:
+            return jsonify({'success': False, 'message': 'Camera not found'}), 404
+        
+        stop_recognition_worker(camera_id)
+        return jsonify({'success': True, 'message': 'Recognition stopped'})
+    except:
+        return jsonify({'success': False, 'message': 'Failed to stop recognition'})
+
+@app.route('/api/cctv-cameras/<int:camera_id>/recognition', methods=['GET'])
+def camera_recognition_status(camera_id):
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    cameras = system.get_cctv_cameras()
+    camera = next((cam for cam in cameras if cam['id'] == camera_id), None)
+    
+    if not camera:
+        return jsonify({'success': False, 'message': 'Camera not found'}), 404
+    
+    worker = recognition_workers.get(camera_id)
+    if worker is not None:
+        status = worker.status()
+    else:
+        status = {'camera_id': camera_id, 'running': False}
+    status['enabled'] = bool(camera.get('recognition'))
+    status['configured_fps'] = camera.get('recognition_fps', DEFAULT_RECOGNITION_FPS)
+    
+    return jsonify({'success': True, 'status': status})
+
+@app.route('/api/cctv-cameras/<int:camera_id>/motion', methods=['POST'])
+def set_camera_motion(camera_id):
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        threshold = float(data.get('threshold', MOTION_DEFAULT_THRESHOLD))
+        if not 0 <= threshold <= 1:
+            return jsonify({'success': False, 'message': 'Threshold must be between 0 and 1'})
+        
+        camera = system.set_camera_motion_threshold(camera_id, threshold)
+        if camera is None:
+            return jsonify({'success': False, 'message': 'Camera not found'}), 404
+        
+        worker = recognition_workers.get(camera_id)
+        if worker is not None:
+            worker.camera['motion_threshold'] = threshold
+        
+        return jsonify({'success': True, 'message': 'Motion threshold updated', 'threshold': threshold})
+    except:
+        return jsonify({'success': False, 'message': 'Failed to update motion threshold'})
+
+@app.route('/api/cctv-cameras/<int:camera_id>/stream-profiles', methods=['GET'])
+def get_stream_profiles(camera_id):
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    camera = next((cam for cam in system.get_cctv_cameras() if cam['id'] == camera_id), None)
+    if camera is None:
+        return jsonify({'success': False, 'message': 'Camera not found'}), 404
+    return jsonify({'success': True, 'profiles': camera_stream_profiles(camera)})
+
+@app.route('/api/cctv-cameras/<int:camera_id>/stream-profiles', methods=['POST'])
+def set_stream_profiles(camera_id):
+    """Body: {"profiles": {"thumbnail": {"width": 320, "height": 180, "quality": 50, "max_fps": 2}}}"""
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        profiles = {}
+        for name, spec in (data.get('profiles') or {}).items():
+            if (not name.replace('-', '').replace('_', '').isalnum() or not isinstance(spec, dict)
+                    or set(spec) - {'width', 'height', 'quality', 'max_fps'}):
+                return jsonify({'success': False, 'message': f'Invalid profile {name}'})
+            
+            cleaned = {}
+            for key, value in spec.items():
+                if value is None and key != 'max_fps':
+                    cleaned[key] = None
+                    continue
+                value = float(value) if key == 'max_fps' else int(value)
+                if value < 0 or (key == 'quality' and not 1 <= value <= 100):
+                    return jsonify({'success': False, 'message': f'Invalid {key} for profile {name}'})
+                cleaned[key] = value
+            if (cleaned.get('width') is None) != (cleaned.get('height') is None):
+                return jsonify({'success': False, 'message': f'Profile {name} needs both width and height'})
+            profiles[name] = cleaned
+        
+        camera = system.set_camera_stream_profiles(camera_id, profiles)
+        if camera is None:
+            return jsonify({'success': False, 'message': 'Camera not found'}), 404
+        return jsonify({'success': True, 'message': 'Stream profiles updated', 'profiles': camera_stream_profiles(camera)})
+    except:
+        return jsonify({'success': False, 'message': 'Failed to update stream profiles'})
+
+@app.route('/api/motion-stats', methods=['GET'])
+def get_motion_stats():
+    if 'admin_logged_in' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    
+    return jsonify({'success': True, 'sources': system.motion_stats()})
+
 @app.route('/api/cctv-stream/<int:camera_id>')
 def cctv_stream(camera_id):
     cameras = system.get_cctv_cameras()
@@ -760,66 +3113,31 @@ def cctv_stream(camera_id):
     if not camera:
         return jsonify({'success': False, 'message': 'Camera not found'}), 404
     
+    # Without ?profile= MJPEG cameras are relayed as they come and OpenCV
+    # sources are sent at 640x480, as before profiles existed.
+    profiles = camera_stream_profiles(camera)
+    profile = request.args.get('profile') or ('full' if is_mjpeg_url(camera['url']) else '640p')
+    if profile not in profiles:
+        return jsonify({'success': False, 'message': f'Unknown profile {profile}',
+                        'profiles': sorted(profiles)}), 400
+    
     def generate_frames():
-        camera_url = camera['url']
+        # Acquired inside the generator so the reference is only held while
+        # the response is actually streaming; closing it releases the reader.
+        reader = acquire_camera_reader(camera)
+        stream = reader.encoded_stream(profile, profiles[profile])
+        sequence = 0
         
         try:
-            if any(x in camera_url.lower() for x in ['mjpeg', 'video', ':4747', ':8080', 'droidcam']):
-                print(f"Using MJPEG mode for: {camera_url}")
-                response = requests.get(camera_url, stream=True, timeout=5)
+            while True:
+                sequence, part = stream.next_part(sequence)
+                if part is None:
+                    print(f"No frames from camera {camera_id}, closing stream")
+                    break
                 
-                if response.status_code == 200:
-                    bytes_data = b''
-                    for chunk in response.iter_content(chunk_size=4096):
-                        if not chunk:
-                            continue
-                        
-                        bytes_data += chunk
-                        
-                        while True:
-                            a = bytes_data.find(b'\xff\xd8')
-                            b = bytes_data.find(b'\xff\xd9')
-                            
-                            if a != -1 and b != -1 and b > a:
-                                jpg = bytes_data[a:b+2]
-                                bytes_data = bytes_data[b+2:]
-                                
-                                yield (b'--frame\r\n'
-                                       b'Content-Type: image/jpeg\r\n\r\n' + jpg + b'\r\n')
-                            else:
-                                break
-            else:
-                print(f"Using OpenCV mode for: {camera_url}")
-                cap = cv2.VideoCapture(camera_url)
-                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                
-                if not cap.isOpened():
-                    print(f"Failed to open camera: {camera_url}")
-                    return
-                
-                while True:
-                    success, frame = cap.read()
-                    if not success:
-                        print("Failed to read frame")
-                        break
-                    
-                    frame = cv2.resize(frame, (640, 480))
-                    
-                    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-                    if not ret:
-                        continue
-                    
-                    frame_bytes = buffer.tobytes()
-                    
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                
-                cap.release()
-                
-        except Exception as e:
-            print(f"Stream error for camera {camera_id}: {str(e)}")
-            import traceback
-            traceback.print_exc()
+                yield part
+        finally:
+            release_camera_reader(reader)
     
     return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
@@ -850,4 +3168,9 @@ if __name__ == '__main__':
     print("Server: http://localhost:5000")
     print("="*60)
     
+    # With debug=True the reloader re-runs this block in a child process; only
+    # the child serves requests, so only it should own the camera workers.
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    
     app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,257 @@
+"""
+ASGI application - camera streams on asyncio, everything else through Flask
+A viewer of /api/cctv-stream is an asyncio task instead of a server thread, so
+hundreds of open streams cost one pump thread per watched camera profile. All
+other routes run in the Flask app on a thread pool, sharing AttendanceSystem.
+
+Needs: pip install uvicorn "asgiref>=3.7,<4"   (sync_to_async with an executor)
+Start with serve.py, or: uvicorn asgi:application --host 0.0.0.0 --port 5000
+Keep it to one worker process; camera readers and recognition live in-process.
+"""
+
+import asyncio
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+import app as attendance
+
+STREAM_PATH = re.compile(r'^/api/(?:public/)?cctv-stream/(\d+)$')
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', '32'))
+PUMP_TIMEOUT = 1.0
+
+
+class StreamFanout:
+    """One (camera, profile) stream handed from its EncodedStream to asyncio viewers.
+
+    A pump thread blocks on the shared camera reader and posts every new part
+    to the event loop; viewers await the next part there. A slow viewer just
+    gets the newest part when it is ready again.
+    """
+
+    def __init__(self, loop, key, camera, profile, spec):
+        self.loop = loop
+        self.key = key
+        self.camera = camera
+        self.profile = profile
+        self.spec = spec
+        self.viewers = 0
+        self.sequence = 0
+        self.part = None
+        self.changed = asyncio.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.pump, name=f"stream-{camera['id']}-{profile}", daemon=True)
+        self.thread.start()
+
+    def pump(self):
+        reader = attendance.acquire_camera_reader(self.camera)
+        try:
+            stream = reader.encoded_stream(self.profile, self.spec)
+            sequence = 0
+            while not self.stop_event.is_set() and not reader.stop_event.is_set():
+                sequence, part = stream.next_part(sequence, timeout=PUMP_TIMEOUT)
+                if part is not None:
+                    self.loop.call_soon_threadsafe(self.publish, sequence, part)
+        finally:
+            attendance.release_camera_reader(reader)
+            # The reader can stop under us (camera removed): never hand this
+            # fanout to another viewer, and let the current ones close now.
+            self.stop_event.set()
+            try:
+                self.loop.call_soon_threadsafe(self.finish)
+            except RuntimeError:
+                pass  # event loop already closed
+
+    def finish(self):
+        if fanouts.get(self.key) is self:
+            del fanouts[self.key]
+        self.changed.set()
+
+    def publish(self, sequence, part):
+        self.sequence = sequence
+        self.part = part
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    async def next_part(self, last_sequence):
+        """(sequence, part) newer than last_sequence, or (last_sequence, None) once stopped."""
+        while self.sequence == last_sequence:
+            if self.stop_event.is_set():
+                return last_sequence, None
+            await asyncio.wait_for(self.changed.wait(), attendance.STREAM_FRAME_TIMEOUT)
+        return self.sequence, self.part
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# Only touched from the event loop thread
+fanouts = {}
+
+
+def acquire_fanout(camera, profile, spec):
+    key = (camera['id'], profile, tuple(sorted(spec.items())))
+    fanout = fanouts.get(key)
+    if fanout is None or fanout.stop_event.is_set():
+        fanout = fanouts[key] = StreamFanout(asyncio.get_running_loop(), key, camera, profile, spec)
+    fanout.viewers += 1
+    return key, fanout
+
+
+def release_fanout(key, fanout):
+    fanout.viewers -= 1
+    if fanout.viewers <= 0:
+        fanout.stop()
+        if fanouts.get(key) is fanout:
+            del fanouts[key]
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def cctv_stream(scope, receive, send, camera_id):
+    """Same contract as app.cctv_stream, including ?profile=."""
+    camera = next((cam for cam in attendance.system.get_cctv_cameras() if cam['id'] == camera_id), None)
+    if camera is None:
+        await send_json(send, 404, {'success': False, 'message': 'Camera not found'})
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    profiles = attendance.camera_stream_profiles(camera)
+    profile = (query.get('profile') or [None])[0] or ('full' if attendance.is_mjpeg_url(camera['url']) else '640p')
+    if profile not in profiles:
+        await send_json(send, 400, {'success': False, 'message': f'Unknown profile {profile}',
+                                    'profiles': sorted(profiles)})
+        return
+
+    async def watch_disconnect():
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+
+    disconnected = asyncio.ensure_future(watch_disconnect())
+    key, fanout = acquire_fanout(camera, profile, profiles[profile])
+    waiting = None
+    try:
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+                                (b'cache-control', b'no-cache')]})
+        sequence = 0
+        while True:
+            # Whichever comes first: the next part or the client leaving
+            waiting = asyncio.ensure_future(fanout.next_part(sequence))
+            await asyncio.wait({waiting, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                break
+            try:
+                sequence, part = waiting.result()
+            except asyncio.TimeoutError:
+                print(f"No frames from camera {camera_id}, closing stream")
+                break
+            if part is None:
+                break
+            await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    except OSError:
+        pass
+    finally:
+        if waiting is not None:
+            waiting.cancel()
+        disconnected.cancel()
+        release_fanout(key, fanout)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await asyncio.get_running_loop().run_in_executor(None, attendance.start_background_services)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for fanout in list(fanouts.values()):
+                fanout.stop()
+            wsgi_pool.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+wsgi_pool = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    """WsgiToAsgiInstance that runs each Flask request on wsgi_pool.
+
+    asgiref's run_wsgi_app is a thread-sensitive sync_to_async, which puts
+    every request on one shared thread. This one calls the WSGI app itself,
+    with thread_sensitive=False on our own pool, WSGI_THREADS requests at a
+    time; only asgiref's public build_environ/start_response are reused.
+    """
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self.call_wsgi_app, thread_sensitive=False, executor=wsgi_pool)(body)
+
+    def call_wsgi_app(self, body):
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            # Too many duplicate headers
+            self.sync_send({'type': 'http.response.start', 'status': 400,
+                            'headers': [(b'content-type', b'text/plain')]})
+            self.sync_send({'type': 'http.response.body', 'body': b'Bad Request'})
+            return
+
+        sent = 0
+        output = self.wsgi_application(environ, self.start_response)
+        try:
+            for chunk in output:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                if self.response_content_length is not None:
+                    chunk = chunk[:self.response_content_length - sent]
+                self.sync_send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                sent += len(chunk)
+                if sent == self.response_content_length:
+                    break
+        finally:
+            # Lets Flask run its request teardown
+            if hasattr(output, 'close'):
+                output.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+flask_application = PooledWsgiToAsgi(attendance.app)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        match = STREAM_PATH.match(scope['path'])
+        if match:
+            await cctv_stream(scope, receive, send, int(match.group(1)))
+            return
+
+    await flask_application(scope, receive, send)
@@ -0,0 +1,87 @@
+"""
+ASGI concurrency check - do Flask routes served through asgi.py run in parallel?
+Registers a route that sleeps, fires concurrent requests at asgi.application
+in-process (no server or network needed) and reports the wall time and the
+threads that served them. Exits with status 1 if the requests were serialized.
+
+Run from the project root (needs asgiref):
+    python benchmarks/asgi_concurrency.py
+    python benchmarks/asgi_concurrency.py --requests 16 --sleep 0.25
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py builds its AttendanceSystem in the current directory on import, so
+# keep it away from the real photos/ and attendance/ folders.
+os.chdir(tempfile.mkdtemp(prefix='asgi_concurrency_'))
+
+import app
+import asgi
+
+SLEEP_PATH = '/_bench/sleep'
+
+
+def add_sleep_route(seconds):
+    def sleep_route():
+        time.sleep(seconds)
+        return threading.current_thread().name
+
+    app.app.add_url_rule(SLEEP_PATH, 'bench_sleep', sleep_route)
+
+
+async def request(path):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+             'query_string': b'', 'headers': [], 'http_version': '1.1', 'scheme': 'http',
+             'server': ('127.0.0.1', 5000), 'client': ('127.0.0.1', 0)}
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.application(scope, receive, send)
+    status = next(m['status'] for m in sent if m['type'] == 'http.response.start')
+    body = b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+    return status, body.decode()
+
+
+async def run(count):
+    start = time.perf_counter()
+    results = await asyncio.gather(*(request(SLEEP_PATH) for _ in range(count)))
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrency of Flask routes behind the ASGI app')
+    parser.add_argument('--requests', type=int, default=8)
+    parser.add_argument('--sleep', type=float, default=0.5, help='seconds each request takes')
+    args = parser.parse_args()
+
+    add_sleep_route(args.sleep)
+    elapsed, results = asyncio.run(run(args.requests))
+    threads = {body for status, body in results if status == 200}
+    serial = args.requests * args.sleep
+
+    print(f"{args.requests} requests of {args.sleep:.2f} s: {elapsed:.2f} s wall "
+          f"(serial would be {serial:.2f} s), {len(threads)} threads, WSGI_THREADS={asgi.WSGI_THREADS}")
+    # Parallel means well under the serial time, allowing for pool limits
+    expected = args.sleep * -(-args.requests // min(args.requests, asgi.WSGI_THREADS))
+    if any(status != 200 for status, _ in results) or elapsed > expected + serial / 4:
+        print("Requests were serialized")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Gallery matcher benchmark - per-employee compare_faces loop vs FaceGallery
+Run from the project root: python benchmarks/bench_gallery.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py builds its AttendanceSystem in the current directory on import, so
+# keep it away from the real photos/ and attendance/ folders.
+os.chdir(tempfile.mkdtemp(prefix='bench_gallery_'))
+
+import app
+
+GALLERY_SIZES = [100, 1000, 10000]
+FACES_PER_FRAME = 4
+
+
+def synthetic_faces(count, seed):
+    rng = np.random.default_rng(seed)
+    faces = rng.integers(0, 256, size=(count,) + app.FACE_SIZE, dtype=np.uint8)
+    return np.stack([cv2.GaussianBlur(face, (9, 9), 3) for face in faces])
+
+
+def loop_match(system, known_face_data, known_face_images, crops):
+    matches = []
+    for face_resized in crops:
+        best_match_score = 0
+        best_match_emp = None
+        for emp_data in known_face_data:
+            emp_id_check = emp_data['Employee_ID']
+            if emp_id_check in known_face_images:
+                score = system.compare_faces(known_face_images[emp_id_check], face_resized)
+                if score > best_match_score:
+                    best_match_score = score
+                    best_match_emp = emp_data
+        matches.append((best_match_emp, best_match_score))
+    return matches
+
+
+def time_call(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    print("="*72)
+    print(f"{'Employees':>10} {'Loop (ms)':>12} {'Gallery (ms)':>14} {'Speedup':>10} {'Max |diff|':>12}")
+    print("="*72)
+    
+    for size in GALLERY_SIZES:
+        templates = synthetic_faces(size, seed=size)
+        known_face_data = [{'Employee_ID': f'E{i:05d}', 'Name': f'Employee {i}'} for i in range(size)]
+        known_face_images = {emp['Employee_ID']: t for emp, t in zip(known_face_data, templates)}
+        
+        # Half the probes are noisy copies of enrolled faces, half are strangers
+        rng = np.random.default_rng(0)
+        enrolled = templates[rng.integers(0, size, FACES_PER_FRAME // 2)].astype(np.int16)
+        enrolled = np.clip(enrolled + rng.integers(-10, 10, enrolled.shape), 0, 255).astype(np.uint8)
+        crops = list(enrolled) + list(synthetic_faces(FACES_PER_FRAME - len(enrolled), seed=size + 1))
+        
+        gallery = app.FaceGallery.from_employees(known_face_data, known_face_images)
+        
+        repeat = 3 if size < 10000 else 1
+        loop_time, loop_result = time_call(
+            lambda: loop_match(app.system, known_face_data, known_face_images, crops), repeat)
+        gallery_time, gallery_result = time_call(lambda: gallery.match(crops), repeat * 3)
+        
+        max_diff = max(abs(a[1] - b[1]) for a, b in zip(loop_result, gallery_result))
+        same_ids = all((a[0] or {}).get('Employee_ID') == (b[0] or {}).get('Employee_ID')
+                       for a, b in zip(loop_result, gallery_result)
+                       if a[1] > app.MATCH_THRESHOLD or b[1] > app.MATCH_THRESHOLD)
+        
+        print(f"{size:>10} {loop_time*1000:>12.1f} {gallery_time*1000:>14.2f} "
+              f"{loop_time/gallery_time:>9.1f}x {max_diff:>12.2e}{'' if same_ids else '  MISMATCH'}")
+    
+    print("="*72)
+    print(f"{FACES_PER_FRAME} faces per frame, best of several runs")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""
+MJPEG relay benchmark - legacy find()-based splitter vs MjpegStream
+Serves a synthetic MJPEG stream from a local HTTP server and reads it back the
+way CameraReader does, in two parts:
+
+  cpu        plain frames both splitters handle; the reading thread's CPU
+             time per frame.
+  integrity  half the frames carry an EXIF thumbnail (an embedded
+             FFD8...FFD9). The legacy splitter cuts those short and then
+             stops emitting frames while its buffer grows, so its run is
+             capped at --legacy-seconds and only the frame counts are kept.
+
+Run from the project root:
+    python benchmarks/bench_mjpeg.py
+    python benchmarks/bench_mjpeg.py --frames 2000 --output mjpeg.json
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+LAUNCH_DIR = os.getcwd()
+
+# app.py builds its AttendanceSystem in the current directory on import
+os.chdir(tempfile.mkdtemp(prefix='bench_mjpeg_'))
+
+import app
+
+RESOLUTIONS = {'640x480': (480, 640), '1920x1080': (1080, 1920)}
+
+
+def synthetic_jpegs(shape, count=8, seed=0, thumbnails=False):
+    rng = np.random.default_rng(seed)
+    jpegs = []
+    for i in range(count):
+        frame = cv2.GaussianBlur(rng.integers(0, 256, shape + (3,), dtype=np.uint8), (15, 15), 0)
+        jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+        if thumbnails and i % 2 == 0:
+            thumb = cv2.imencode('.jpg', cv2.resize(frame, (160, 120)))[1].tobytes()
+            app1 = b'Exif\x00\x00' + thumb
+            jpeg = jpeg[:2] + b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 + jpeg[2:]
+        jpegs.append(jpeg)
+    return jpegs
+
+
+def serve(jpegs, frames, with_length):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=bench')
+            self.end_headers()
+            for i in range(frames):
+                jpeg = jpegs[i % len(jpegs)]
+                header = b'--bench\r\nContent-Type: image/jpeg\r\n'
+                if with_length:
+                    header += b'Content-Length: %d\r\n' % len(jpeg)
+                try:
+                    self.wfile.write(header + b'\r\n' + jpeg + b'\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    # A capped legacy run hangs up mid-stream
+                    return
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def legacy_frames(response, deadline=None):
+    """The splitter CameraReader used before MjpegStream, stopped at deadline."""
+    bytes_data = b''
+    for chunk in response.iter_content(chunk_size=4096):
+        if deadline is not None and time.perf_counter() > deadline:
+            return
+        if not chunk:
+            continue
+        bytes_data += chunk
+        while True:
+            a = bytes_data.find(b'\xff\xd8')
+            b = bytes_data.find(b'\xff\xd9')
+            if a != -1 and b != -1 and b > a:
+                jpg = bytes_data[a:b+2]
+                bytes_data = bytes_data[b+2:]
+                yield jpg
+            else:
+                break
+
+
+def stream_frames(response):
+    stream = app.MjpegStream(response.raw, app.MjpegStream.boundary_from(response.headers.get('Content-Type')))
+    try:
+        for jpeg in stream.frames():
+            yield jpeg
+    except EOFError:
+        return
+
+
+def run(url, parser, valid):
+    response = requests.get(url, stream=True, timeout=10)
+    frames = 0
+    intact = 0
+    published = 0
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    for jpeg in parser(response):
+        frames += 1
+        # What publish() does: one copy into the shared multipart part
+        published += len(app.stream_part(jpeg))
+        intact += bytes(jpeg[-64:]) in valid
+    cpu = time.thread_time() - cpu
+    wall = time.perf_counter() - wall
+    response.close()
+    return {
+        'frames': frames,
+        'intact_frames': intact,
+        'cpu_ms_per_frame': round(cpu * 1000 / max(frames, 1), 4),
+        'cpu_s_per_stream_minute_at_25fps': round(cpu / max(frames, 1) * 25 * 60, 3),
+        'frames_per_second': round(frames / wall, 1) if wall > 0 else None,
+        'bytes_relayed': published,
+    }
+
+
+def integrity(url, parser, valid, frames):
+    response = requests.get(url, stream=True, timeout=10)
+    received = 0
+    intact = 0
+    for jpeg in parser(response):
+        received += 1
+        intact += bytes(jpeg[-64:]) in valid
+    response.close()
+    return {'frames': received, 'intact_frames': intact, 'complete': intact == frames}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MJPEG relay CPU per stream')
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--integrity-frames', type=int, default=200)
+    parser.add_argument('--legacy-seconds', type=float, default=10.0,
+                        help='cap on the legacy splitter in the integrity test')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    report = {'cpu': [], 'integrity': []}
+    print("CPU per frame (no thumbnails):")
+    for name, shape in RESOLUTIONS.items():
+        jpegs = synthetic_jpegs(shape)
+        # Frames are identified by their last 64 bytes; a truncated one won't match
+        valid = {jpeg[-64:] for jpeg in jpegs}
+        for with_length in (True, False):
+            server = serve(jpegs, args.frames, with_length)
+            url = f'http://127.0.0.1:{server.server_address[1]}/video'
+            row = {
+                'resolution': name,
+                'frame_bytes': int(np.mean([len(j) for j in jpegs])),
+                'content_length': with_length,
+                'legacy': run(url, legacy_frames, valid),
+                'mjpeg_stream': run(url, stream_frames, valid),
+            }
+            server.shutdown()
+            report['cpu'].append(row)
+            print(f"  {name:>9} content-length={'yes' if with_length else 'no ':<3} "
+                  f"legacy {row['legacy']['cpu_ms_per_frame']:>7.3f} ms/frame, "
+                  f"MjpegStream {row['mjpeg_stream']['cpu_ms_per_frame']:>7.3f} ms/frame")
+
+    print(f"Frame integrity (half the frames with EXIF thumbnails, legacy capped at {args.legacy_seconds:g} s):")
+    for name, shape in RESOLUTIONS.items():
+        jpegs = synthetic_jpegs(shape, thumbnails=True)
+        valid = {jpeg[-64:] for jpeg in jpegs}
+        for with_length in (True, False):
+            server = serve(jpegs, args.integrity_frames, with_length)
+            url = f'http://127.0.0.1:{server.server_address[1]}/video'
+            deadline = time.perf_counter() + args.legacy_seconds
+            row = {
+                'resolution': name,
+                'content_length': with_length,
+                'legacy': integrity(url, lambda response: legacy_frames(response, deadline), valid,
+                                    args.integrity_frames),
+                'mjpeg_stream': integrity(url, stream_frames, valid, args.integrity_frames),
+            }
+            server.shutdown()
+            report['integrity'].append(row)
+            print(f"  {name:>9} content-length={'yes' if with_length else 'no ':<3} "
+                  f"legacy {row['legacy']['intact_frames']}/{args.integrity_frames} intact "
+                  f"({row['legacy']['frames']} emitted), "
+                  f"MjpegStream {row['mjpeg_stream']['intact_frames']}/{args.integrity_frames} intact")
+
+    if args.output:
+        with open(os.path.join(LAUNCH_DIR, args.output), 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
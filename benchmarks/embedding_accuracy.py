@@ -0,0 +1,142 @@
+"""
+Embedding accuracy - projected (eigenface) gallery vs the full-pixel matcher
+Enrolls every face found in photos/, then matches camera-like variations of
+each one (shift, scale, lighting, blur, noise) with both galleries and reports
+how often the projected gallery agrees with the pixel matcher, per dimension.
+
+Run from the project root:
+    python benchmarks/embedding_accuracy.py
+    python benchmarks/embedding_accuracy.py --dims 32 64 128 256 --variants 8
+    python benchmarks/embedding_accuracy.py --photos path/to/photos --output acc.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+LAUNCH_DIR = os.getcwd()
+
+# app.py builds its AttendanceSystem in the current directory on import, so
+# keep it away from the real photos/ and attendance/ folders.
+os.chdir(tempfile.mkdtemp(prefix='embedding_accuracy_'))
+
+import app
+from recognition_engine import FaceGallery, ProjectedGallery, MATCH_THRESHOLD
+
+
+def load_templates(system, photos_dir):
+    employees = []
+    templates = []
+    for name in sorted(os.listdir(photos_dir)):
+        if not name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        template = system.detect_face_template(os.path.join(photos_dir, name))
+        if template is not None:
+            employees.append({'Employee_ID': os.path.splitext(name)[0]})
+            templates.append(template)
+    return employees, templates
+
+
+def camera_variants(template, count, rng):
+    """Perturbed copies of an enrolled crop, standing in for live captures."""
+    size = app.FACE_SIZE[0]
+    variants = []
+    for _ in range(count):
+        scale = rng.uniform(0.92, 1.08)
+        shift = rng.uniform(-4, 4, size=2)
+        matrix = cv2.getRotationMatrix2D((size / 2, size / 2), rng.uniform(-5, 5), scale)
+        matrix[:, 2] += shift
+        face = cv2.warpAffine(template, matrix, app.FACE_SIZE, borderMode=cv2.BORDER_REPLICATE)
+        face = cv2.convertScaleAbs(face, alpha=rng.uniform(0.8, 1.2), beta=rng.uniform(-20, 20))
+        face = cv2.GaussianBlur(face, (3, 3), rng.uniform(0.1, 1.2))
+        noise = rng.normal(0, 4, face.shape)
+        variants.append(np.clip(face + noise, 0, 255).astype(np.uint8))
+    return variants
+
+
+def evaluate(gallery, queries, truth, reference):
+    start = time.perf_counter()
+    best = gallery.best_matches(queries)
+    elapsed = time.perf_counter() - start
+
+    rows = np.array([i for i, _ in best])
+    scores = np.array([s for _, s in best])
+    accepted = scores > MATCH_THRESHOLD
+    result = {
+        'top1_correct': round(float(np.mean(rows == truth)), 4),
+        'accepted_correct': round(float(np.mean(accepted & (rows == truth))), 4),
+        'match_ms_per_face': round(elapsed * 1000 / len(queries), 4),
+        'bytes_per_employee': int(gallery.matrix.itemsize * gallery.matrix.shape[1] + 3 * 8),
+        'basis_bytes': int(getattr(gallery, 'components', np.zeros(0)).nbytes),
+    }
+    if reference is not None:
+        ref_rows, ref_scores, ref_accepted = reference
+        result['agrees_with_pixels'] = round(float(np.mean((rows == ref_rows) & (accepted == ref_accepted))), 4)
+        result['score_mean_abs_error'] = round(float(np.mean(np.abs(scores - ref_scores))), 4)
+    return result, (rows, scores, accepted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Projected gallery accuracy against the pixel matcher')
+    parser.add_argument('--photos', default=os.path.join(ROOT, 'photos'), help='folder of enrolled photos')
+    parser.add_argument('--dims', type=int, nargs='+', default=[16, 32, 64, 128, 256])
+    parser.add_argument('--variants', type=int, default=5, help='camera-like variations per employee')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+    args.photos = os.path.join(LAUNCH_DIR, args.photos)
+
+    if not os.path.isdir(args.photos):
+        print(f"No photos folder at {args.photos}")
+        return
+
+    employees, templates = load_templates(app.system, args.photos)
+    print(f"{len(templates)} faces enrolled from {args.photos}")
+    if len(templates) < 2:
+        print("Need at least two detectable faces to compare matchers")
+        return
+
+    rng = np.random.default_rng(0)
+    queries = []
+    truth = []
+    for row, template in enumerate(templates):
+        for face in camera_variants(template, args.variants, rng):
+            queries.append(face)
+            truth.append(row)
+    truth = np.array(truth)
+
+    pixels, reference = evaluate(FaceGallery(employees, templates), queries, truth, None)
+    print(f"  pixels      top-1 {pixels['top1_correct']:.3f}, accepted {pixels['accepted_correct']:.3f}, "
+          f"{pixels['bytes_per_employee']:>6} B/employee")
+
+    report = {'faces': len(templates), 'queries': len(queries), 'pixels': pixels, 'projected': []}
+    for dims in args.dims:
+        if dims >= len(templates):
+            print(f"  dims={dims:<5} skipped: needs more than {dims} enrolled faces")
+            continue
+        start = time.perf_counter()
+        gallery = ProjectedGallery(employees, templates, dims=dims)
+        fit_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        result, _ = evaluate(gallery, queries, truth, reference)
+        result.update({'dims': dims, 'fit_ms': fit_ms})
+        report['projected'].append(result)
+        print(f"  dims={dims:<5} top-1 {result['top1_correct']:.3f}, accepted {result['accepted_correct']:.3f}, "
+              f"agrees {result['agrees_with_pixels']:.3f}, score error {result['score_mean_abs_error']:.4f}, "
+              f"{result['bytes_per_employee']:>6} B/employee")
+
+    if args.output:
+        with open(os.path.join(LAUNCH_DIR, args.output), 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Gallery index recall/latency - coarse k-means index vs brute-force matching
+Builds a synthetic gallery with face-like structure (shared eigenfaces plus
+per-person detail), then matches perturbed copies of enrolled faces both ways
+and reports, for each probe count, how often the index finds the same best
+match as brute force and what it costs per face.
+
+Run from the project root:
+    python benchmarks/index_recall.py                              (50k, 128-d embeddings)
+    python benchmarks/index_recall.py --size 10000 --embedding-dims 0   (pixel gallery)
+    python benchmarks/index_recall.py --cells 1024 --probes 4 8 16 32 --output recall.json
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from recognition_engine import FaceGallery, ProjectedGallery, FACE_SIZE, MATCH_THRESHOLD
+
+
+def synthetic_population(count, seed, rank=40, chunk=2048):
+    rng = np.random.default_rng(seed)
+    pixels = FACE_SIZE[0] * FACE_SIZE[1]
+    mean = cv2.GaussianBlur(rng.uniform(90, 170, FACE_SIZE), (0, 0), 12).reshape(-1)
+    basis = np.stack([cv2.GaussianBlur(rng.normal(0, 1, FACE_SIZE), (0, 0), 4).reshape(-1) for _ in range(rank)])
+    basis *= 30 / basis.std(axis=1, keepdims=True)
+
+    faces = np.empty((count,) + FACE_SIZE, dtype=np.uint8)
+    for start in range(0, count, chunk):
+        size = min(chunk, count - start)
+        block = mean + rng.normal(0, 1, (size, rank)) @ basis / math.sqrt(rank) * 2
+        block += rng.normal(0, 12, (size, pixels))
+        faces[start:start + size] = np.clip(block, 0, 255).reshape((size,) + FACE_SIZE)
+    return faces
+
+
+def perturb(faces, seed):
+    rng = np.random.default_rng(seed)
+    noisy = faces.astype(np.float64) * rng.uniform(0.85, 1.15, (len(faces), 1, 1))
+    noisy += rng.uniform(-15, 15, (len(faces), 1, 1)) + rng.normal(0, 8, faces.shape)
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Coarse index recall and latency against brute force')
+    parser.add_argument('--size', type=int, default=50000, help='enrolled employees')
+    parser.add_argument('--embedding-dims', type=int, default=128, help='0 for the full-pixel gallery')
+    parser.add_argument('--cells', type=int, help='k-means cells (default 4 x sqrt(size))')
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    args = parser.parse_args()
+
+    cells = args.cells or int(4 * math.sqrt(args.size))
+    templates = synthetic_population(args.size, seed=1)
+    employees = [{'Employee_ID': f'E{i:06d}'} for i in range(args.size)]
+
+    if args.embedding_dims > 0:
+        gallery, build_s = timed(lambda: ProjectedGallery(employees, templates, dims=args.embedding_dims))
+    else:
+        gallery, build_s = timed(lambda: FaceGallery(employees, templates))
+    _, index_s = timed(lambda: gallery.with_index(cells, args.probes[0]))
+    sizes = np.array([len(members) for members in gallery.index.members])
+    print(f"Gallery {args.size} ({'pixels' if args.embedding_dims <= 0 else f'{args.embedding_dims}-d'}) "
+          f"built in {build_s:.1f} s, {cells} cells in {index_s:.1f} s "
+          f"(cell size median {int(np.median(sizes))}, max {sizes.max()})")
+
+    rng = np.random.default_rng(2)
+    truth = rng.choice(args.size, min(args.queries, args.size), replace=False)
+    queries = perturb(templates[truth], seed=3)
+
+    index, gallery.index = gallery.index, None
+    brute, brute_s = timed(lambda: gallery.best_matches(queries))
+    gallery.index = index
+    brute_rows = np.array([i for i, _ in brute])
+    brute_accepted = np.array([s for _, s in brute]) > MATCH_THRESHOLD
+    print(f"  brute force      {brute_s * 1000 / len(queries):>8.3f} ms/face, "
+          f"top-1 correct {np.mean(brute_rows == truth):.3f}")
+
+    report = {
+        'size': args.size,
+        'embedding_dims': args.embedding_dims,
+        'cells': cells,
+        'build_s': round(build_s, 2),
+        'index_build_s': round(index_s, 2),
+        'cell_size_median': int(np.median(sizes)),
+        'cell_size_max': int(sizes.max()),
+        'brute_ms_per_face': round(brute_s * 1000 / len(queries), 4),
+        'brute_top1_correct': round(float(np.mean(brute_rows == truth)), 4),
+        'probes': []
+    }
+
+    for probes in args.probes:
+        found, index_s = timed(lambda: gallery.best_matches(queries, probes=probes))
+        rows = np.array([i for i, _ in found])
+        accepted = np.array([s for _, s in found]) > MATCH_THRESHOLD
+        result = {
+            'probes': probes,
+            'recall_at_1': round(float(np.mean(rows == brute_rows)), 4),
+            'decision_agreement': round(float(np.mean((rows == brute_rows) & (accepted == brute_accepted))), 4),
+            'ms_per_face': round(index_s * 1000 / len(queries), 4),
+            'speedup': round(brute_s / index_s, 1) if index_s > 0 else None,
+        }
+        report['probes'].append(result)
+        print(f"  probes={probes:<4} recall@1 {result['recall_at_1']:.3f}, "
+              f"{result['ms_per_face']:>8.3f} ms/face ({result['speedup']}x)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
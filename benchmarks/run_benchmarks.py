@@ -0,0 +1,313 @@
+"""
+Benchmark suite - startup, recognition, attendance writes and CSV export
+Needs no camera or network: the gallery, photos, frames and attendance history
+are all synthetic and live in a temporary directory.
+
+Run from the project root:
+    python benchmarks/run_benchmarks.py                   (full run)
+    python benchmarks/run_benchmarks.py --quick           (small sizes)
+    python benchmarks/run_benchmarks.py --output bench.json
+"""
+
+import argparse
+import contextlib
+import csv
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+LAUNCH_DIR = os.getcwd()
+
+# app.py builds its AttendanceSystem in the current directory on import, so
+# everything it writes ends up in the scratch directory.
+WORK_DIR = tempfile.mkdtemp(prefix='attendance_bench_')
+os.chdir(WORK_DIR)
+
+import app
+
+BENCH_DAY = datetime(2001, 1, 1, 8, 0, 0)
+
+FULL = {
+    'startup_photos': [100, 1000],
+    'gallery_sizes': [100, 1000, 10000],
+    'faces_per_frame': [1, 4, 8],
+    'frame_repeat': 10,
+    'mark_steps': 5,
+    'mark_batch': 200,
+    'export_employees': 200,
+    'export_days': 365,
+}
+
+QUICK = {
+    'startup_photos': [50],
+    'gallery_sizes': [100, 1000],
+    'faces_per_frame': [1, 4],
+    'frame_repeat': 3,
+    'mark_steps': 3,
+    'mark_batch': 50,
+    'export_employees': 50,
+    'export_days': 60,
+}
+
+
+def measure(fn, repeat=5):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(timings) * 1000, 3),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+    }, result
+
+
+def draw_face(canvas, x, y, size, seed):
+    """Cartoon frontal face: enough structure for the Haar cascade to fire."""
+    rng = np.random.default_rng(seed)
+    cx, cy = x + size // 2, y + size // 2
+    skin = int(rng.integers(150, 210))
+
+    cv2.ellipse(canvas, (cx, cy), (int(size * 0.38), int(size * 0.5)), 0, 0, 360, skin, -1)
+    for side in (-1, 1):
+        ex = cx + side * int(size * 0.16)
+        ey = cy - int(size * 0.1)
+        cv2.ellipse(canvas, (ex, ey), (int(size * 0.08), int(size * 0.04)), 0, 0, 360, 40, -1)
+        cv2.line(canvas, (ex - int(size * 0.09), ey - int(size * 0.09)),
+                 (ex + int(size * 0.09), ey - int(size * 0.1)), 60, max(1, size // 40))
+    cv2.line(canvas, (cx, cy - int(size * 0.02)), (cx - int(size * 0.03), cy + int(size * 0.12)),
+             skin - 50, max(1, size // 50))
+    cv2.ellipse(canvas, (cx, cy + int(size * 0.24)), (int(size * 0.13), int(size * 0.05)),
+                0, 0, 180, 70, max(1, size // 35))
+
+
+def synthetic_frame(faces, seed, shape=(480, 640)):
+    rng = np.random.default_rng(seed)
+    frame = np.full(shape, 110, dtype=np.uint8)
+    frame = cv2.add(frame, rng.integers(0, 20, shape, dtype=np.uint8))
+
+    size = 120
+    columns = max(1, shape[1] // (size + 10))
+    for i in range(faces):
+        row, col = divmod(i, columns)
+        draw_face(frame, 10 + col * (size + 10), 10 + row * (size + 30), size, seed + i)
+    return cv2.GaussianBlur(frame, (3, 3), 0)
+
+
+def synthetic_templates(count, seed):
+    rng = np.random.default_rng(seed)
+    faces = rng.integers(0, 256, size=(count,) + app.FACE_SIZE, dtype=np.uint8)
+    return np.stack([cv2.GaussianBlur(face, (9, 9), 3) for face in faces])
+
+
+def synthetic_employees(count, prefix='E'):
+    return [{'Employee_ID': f'{prefix}{i:05d}', 'Name': f'Employee {i}', 'Phone': f'555-{i:05d}',
+             'Address': '', 'Photo_Path': ''} for i in range(count)]
+
+
+def bench_startup(system, sizes):
+    results = []
+    for count in sizes:
+        with open(system.registration_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Employee_ID', 'Name', 'Phone', 'Address', 'Photo_Path', 'Registration_Date'])
+            for i in range(count):
+                photo_path = system.photos_dir / f'S{i:05d}.jpg'
+                if not photo_path.exists():
+                    photo = np.full((480, 360), 120, dtype=np.uint8)
+                    draw_face(photo, 60, 80, 240, seed=i)
+                    cv2.imwrite(str(photo_path), photo)
+                writer.writerow([f'S{i:05d}', f'Startup {i}', '', '', str(photo_path), ''])
+
+        for path in (system.face_index_file, system.face_index_manifest):
+            if path.exists():
+                path.unlink()
+
+        cold, _ = measure(system.load_employee_data, repeat=1)
+        warm, _ = measure(system.load_employee_data, repeat=3)
+        results.append({
+            'photos': count,
+            'templates': len(system.known_face_images),
+            'cold_index': cold,
+            'warm_index': warm,
+        })
+        print(f"  startup {count:>6} photos: cold {cold['min_ms']:>10.1f} ms, warm {warm['min_ms']:>8.1f} ms")
+    return results
+
+
+def bench_process_frame(system, gallery_sizes, faces_per_frame, repeat):
+    results = []
+    frames = {faces: synthetic_frame(faces, seed=faces) for faces in faces_per_frame}
+
+    for size in gallery_sizes:
+        employees = synthetic_employees(size)
+        system.set_gallery(app.FaceGallery(employees, synthetic_templates(size, seed=size)))
+
+        for faces, frame in frames.items():
+            detected = len(system.detect_faces(frame))
+            crops = list(synthetic_templates(faces, seed=faces + 7))
+
+            full, _ = measure(lambda: system.process_frame(frame), repeat)
+            match, _ = measure(lambda: system.gallery.match(crops), repeat)
+            results.append({
+                'gallery_size': size,
+                'faces_drawn': faces,
+                'faces_detected': detected,
+                'process_frame': full,
+                'gallery_match': match,
+            })
+            print(f"  process_frame gallery={size:>6} faces={faces} (detected {detected}): "
+                  f"{full['median_ms']:>8.2f} ms, match {match['median_ms']:>7.3f} ms")
+    return results
+
+
+def bench_mark_attendance(system, steps, batch):
+    results = []
+    employees = synthetic_employees(steps * batch, prefix='M')
+    day = BENCH_DAY.strftime('%Y-%m-%d')
+    system.attendance_log.import_events(day, [])
+
+    for step in range(steps):
+        chunk = employees[step * batch:(step + 1) * batch]
+
+        def mark_chunk():
+            for i, emp in enumerate(chunk):
+                system.mark_attendance(emp, BENCH_DAY + timedelta(seconds=step * batch + i))
+
+        # mark_attendance only enqueues; the flush is the writer committing them
+        marked, _ = measure(mark_chunk, repeat=1)
+        flushed, _ = measure(system.attendance_log.flush, repeat=1)
+        workbook, _ = measure(lambda: system.write_day_workbook(day), repeat=1)
+        total = (step + 1) * batch
+        results.append({
+            'events_in_day': total,
+            'batch': batch,
+            'mark_batch': marked,
+            'marks_per_second': round(batch / max(marked['min_ms'] / 1000, 1e-9), 1),
+            'flush': flushed,
+            'workbook_export': workbook,
+        })
+        print(f"  mark_attendance day size {total:>6}: {results[-1]['marks_per_second']:>10.1f} marks/s, "
+              f"flush {flushed['min_ms']:>7.1f} ms, workbook {workbook['min_ms']:>8.1f} ms")
+    return results
+
+
+def bench_download_csv(system, employees, days):
+    employee_rows = synthetic_employees(employees, prefix='X')
+    # The exports look phones up through employee_index, so rebuild it too
+    system.known_face_data = []
+    system.employee_index = {}
+    for emp in employee_rows:
+        system.index_employee(emp)
+
+    start_day = BENCH_DAY.date().replace(year=2002, month=1, day=1)
+    for offset in range(days):
+        day = (start_day + timedelta(days=offset)).strftime('%Y-%m-%d')
+        events = [{
+            'date': day,
+            'time': f'08:{i % 60:02d}:00',
+            'employee_id': emp['Employee_ID'],
+            'name': emp['Name'],
+            'status': 'Late' if i % 7 == 0 else 'Present',
+            'minutes_late': 5 if i % 7 == 0 else 0
+        } for i, emp in enumerate(employee_rows)]
+        system.attendance_log.import_events(day, events)
+
+    client = app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['admin_logged_in'] = True
+
+    target = (start_day + timedelta(days=min(days, 180) - 1)).strftime('%Y-%m-%d')
+    results = []
+    for period in ('day', 'month', 'year'):
+        def post_csv():
+            response = client.post('/api/download-csv', json={'type': period, 'date': target})
+            return response.get_json().get('records', 0)
+
+        def stream_csv():
+            response = client.get(f'/api/export/attendance.csv?type={period}&date={target}')
+            return len(response.get_data())
+
+        posted, records = measure(post_csv, repeat=3)
+        streamed, size = measure(stream_csv, repeat=3)
+        results.append({
+            'period': period,
+            'records': records,
+            'download_csv': posted,
+            'stream_export': streamed,
+            'stream_bytes': size,
+        })
+        print(f"  download_csv {period:>5}: {records:>8} rows, json {posted['median_ms']:>9.1f} ms, "
+              f"stream {streamed['median_ms']:>9.1f} ms")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Attendance system benchmarks')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes for a fast smoke run')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args()
+
+    config = QUICK if args.quick else FULL
+    system = app.system
+
+    # Progress (and anything app.py prints) goes to stderr; stdout is only the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(system, config)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(os.path.join(LAUNCH_DIR, args.output), 'w') as f:
+            f.write(output)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+def run(system, config):
+    print("="*72)
+    print(f"Benchmarking in {WORK_DIR}")
+    print("="*72)
+
+    return {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'config': config,
+        'results': {
+            'load_employee_data': bench_startup(system, config['startup_photos']),
+            'process_frame': bench_process_frame(system, config['gallery_sizes'],
+                                                 config['faces_per_frame'], config['frame_repeat']),
+            'mark_attendance': bench_mark_attendance(system, config['mark_steps'], config['mark_batch']),
+            'download_csv': bench_download_csv(system, config['export_employees'], config['export_days']),
+        }
+    }
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Command-line maintenance for the attendance system
+Run from the project folder (next to registration.csv), with the server stopped:
+    python manage.py enroll staff_photos/                    (manifest.csv inside the folder)
+    python manage.py enroll staff.zip --manifest staff.csv --report enroll_report.csv
+    python manage.py rebuild-rollups                         (recompute report totals)
+"""
+
+import argparse
+import csv
+import os
+import sys
+
+import app
+
+
+def enroll(args):
+    if not os.path.exists(args.source):
+        print(f"No such folder or archive: {args.source}")
+        return 1
+
+    manifest_text = None
+    if args.manifest:
+        with open(args.manifest, 'r', encoding='utf-8-sig') as f:
+            manifest_text = f.read()
+
+    result = app.system.bulk_register(args.source, manifest_text)
+    print(result['message'])
+    if not result['success']:
+        return 1
+
+    for status, count in sorted(result['counts'].items()):
+        print(f"  {status:<16} {count}")
+    for entry in result['rows']:
+        if entry['status'] != 'registered':
+            print(f"  line {entry['line']:>5}  {entry['emp_id'] or '-':<16} {entry['status']:<16} {entry['message']}")
+
+    if args.report:
+        with open(args.report, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['line', 'emp_id', 'photo', 'status', 'message'])
+            writer.writeheader()
+            writer.writerows(result['rows'])
+        print(f"Report written to {args.report}")
+    return 0
+
+
+def rebuild_rollups(args):
+    try:
+        app.system.attendance_log.flush()
+    except RuntimeError as e:
+        print(str(e))
+        return 1
+    events = app.system.attendance_log.rebuild_rollups()
+    print(f"Rollups rebuilt from {events} attendance events")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Attendance system maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enroll_parser = commands.add_parser('enroll', help='bulk-register employees from a folder or zip of photos')
+    enroll_parser.add_argument('source', help='folder or .zip with the photos')
+    enroll_parser.add_argument('--manifest', help='CSV with Employee_ID, Name, Phone, Address, Photo '
+                                                  '(default: manifest.csv inside the source)')
+    enroll_parser.add_argument('--report', help='write the per-row report to this CSV file')
+    enroll_parser.set_defaults(handler=enroll)
+
+    rebuild_parser = commands.add_parser('rebuild-rollups',
+                                         help='recompute the day, month and employee report totals')
+    rebuild_parser.set_defaults(handler=rebuild_rollups)
+
+    args = parser.parse_args()
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
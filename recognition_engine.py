@@ -0,0 +1,452 @@
+"""
+Recognition engine - gallery scoring and the multi-process detect/match pool
+Kept free of Flask and AttendanceSystem so spawned workers import only this.
+"""
+
+import cv2
+import numpy as np
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+FACE_SIZE = (100, 100)
+MATCH_THRESHOLD = 0.65
+ENGINE_TIMEOUT = 10.0
+EMBEDDING_FIT_SAMPLE = 4096
+INDEX_KMEANS_ITERATIONS = 10
+INDEX_TRAIN_PER_CELL = 64
+
+class CoarseIndex:
+    """Inverted-file index over gallery rows: k-means cells, probe the nearest few.
+    
+    Rows and queries live in the gallery's own space (pixels or projected
+    embeddings). Cells are found with spherical k-means on the rows scaled
+    to unit length, and a query only scores the rows of its `probes` most
+    similar cells; picking the nearest centroid ignores a row's length.
+    """
+    
+    def __init__(self, centroids, assignments, probes):
+        self.centroids = centroids
+        self.assignments = assignments
+        self.probes = probes
+        
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        self.members = [order[bounds[i]:bounds[i + 1]] for i in range(len(centroids))]
+    
+    @classmethod
+    def build(cls, matrix, cells, probes, iterations=INDEX_KMEANS_ITERATIONS, seed=0):
+        rng = np.random.default_rng(seed)
+        cells = max(1, min(cells, len(matrix)))
+        
+        sample_size = min(len(matrix), cells * INDEX_TRAIN_PER_CELL)
+        sample = np.asarray(matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))], dtype=np.float32)
+        norms = np.linalg.norm(sample, axis=1)
+        sample /= np.where(norms > 0, norms, 1.0)[:, None]
+        centroids = sample[rng.choice(len(sample), cells, replace=False)].copy()
+        
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=cells)
+            
+            # Empty cells restart from a random training row
+            empty = np.flatnonzero(counts == 0)
+            sums[empty] = sample[rng.choice(len(sample), len(empty))]
+            norms = np.linalg.norm(sums, axis=1)
+            centroids = sums / np.where(norms > 0, norms, 1.0)[:, None]
+        
+        return cls(centroids.astype(np.float32), cls.assign(centroids, matrix), probes)
+    
+    @staticmethod
+    def assign(centroids, matrix, chunk=4096):
+        assignments = np.empty(len(matrix), dtype=np.int32)
+        for start in range(0, len(matrix), chunk):
+            block = np.asarray(matrix[start:start + chunk], dtype=np.float32)
+            assignments[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+    
+    def with_row(self, vector):
+        """Copy with one appended row; only the receiving cell's list is rebuilt."""
+        cell = int(self.assign(self.centroids, np.asarray(vector).reshape(1, -1))[0])
+        index = CoarseIndex.__new__(CoarseIndex)
+        index.centroids = self.centroids
+        index.assignments = np.append(self.assignments, np.int32(cell))
+        index.probes = self.probes
+        index.members = list(self.members)
+        index.members[cell] = np.append(self.members[cell], len(self.assignments))
+        return index
+    
+    def candidates(self, vectors, probes=None):
+        probes = min(probes or self.probes, len(self.centroids))
+        similarity = np.asarray(vectors, dtype=np.float32) @ self.centroids.T
+        nearest = np.argpartition(-similarity, probes - 1, axis=1)[:, :probes]
+        return [np.concatenate([self.members[cell] for cell in cells]) for cells in nearest]
+
+class FaceGallery:
+    """Enrolled face templates packed into one contiguous, pre-normalized matrix.
+
+    Scores are the mean of TM_CCOEFF_NORMED and TM_CCORR_NORMED, exactly what
+    compare_faces computes for two equally sized crops, but for every face in a
+    frame against every employee in one matrix product.
+    """
+    
+    def __init__(self, employees=None, templates=None):
+        self.employees = list(employees or [])
+        self.ids = [emp['Employee_ID'] for emp in self.employees]
+        
+        if self.employees:
+            stacked = np.stack([np.asarray(t, dtype=np.uint8).reshape(FACE_SIZE) for t in templates])
+        else:
+            stacked = np.zeros((0,) + FACE_SIZE, dtype=np.uint8)
+        
+        self.templates = np.ascontiguousarray(stacked)
+        self.matrix, self.means, self.centered_norms, self.raw_norms = self.normalize(self.templates)
+        self.index = None
+    
+    @classmethod
+    def from_normalized(cls, matrix, means, centered_norms, raw_norms, employees=None):
+        gallery = cls.__new__(cls)
+        gallery.employees = list(employees or [])
+        gallery.ids = [emp['Employee_ID'] for emp in gallery.employees]
+        gallery.templates = None
+        gallery.matrix = matrix
+        gallery.means = means
+        gallery.centered_norms = centered_norms
+        gallery.raw_norms = raw_norms
+        gallery.index = None
+        return gallery
+    
+    @classmethod
+    def from_employees(cls, known_face_data, known_face_images, **options):
+        employees = []
+        templates = []
+        seen = set()
+        for emp_data in known_face_data:
+            emp_id = emp_data['Employee_ID']
+            if emp_id in known_face_images and emp_id not in seen:
+                seen.add(emp_id)
+                employees.append(emp_data)
+                templates.append(known_face_images[emp_id])
+        return cls(employees, templates, **options)
+    
+    @staticmethod
+    def normalize(faces, chunk=1024):
+        faces = np.asarray(faces)
+        count = len(faces)
+        pixels = FACE_SIZE[0] * FACE_SIZE[1]
+        
+        matrix = np.empty((count, pixels), dtype=np.float32)
+        means = np.empty(count, dtype=np.float64)
+        centered_norms = np.empty(count, dtype=np.float64)
+        raw_norms = np.empty(count, dtype=np.float64)
+        
+        # Statistics in float64 so the reconstructed CCORR term stays exact;
+        # chunked so a 10k gallery doesn't need a full float64 copy.
+        for start in range(0, count, chunk):
+            flat = faces[start:start + chunk].reshape(-1, pixels).astype(np.float64)
+            block_means = flat.mean(axis=1)
+            centered = flat - block_means[:, None]
+            block_norms = np.sqrt(np.einsum('ij,ij->i', centered, centered))
+            
+            end = start + len(flat)
+            means[start:end] = block_means
+            centered_norms[start:end] = block_norms
+            raw_norms[start:end] = np.sqrt(np.einsum('ij,ij->i', flat, flat))
+            
+            safe_norms = np.where(block_norms > 0, block_norms, 1.0)
+            matrix[start:end] = centered / safe_norms[:, None]
+        
+        return matrix, means, centered_norms, raw_norms
+    
+    def __len__(self):
+        return len(self.matrix)
+    
+    def shared_arrays(self):
+        return (self.matrix, self.means, self.centered_norms, self.raw_norms)
+    
+    def query_vectors(self, faces):
+        return self.normalize(faces)
+    
+    def with_index(self, cells, probes):
+        self.index = CoarseIndex.build(self.matrix, cells, probes)
+        return self
+    
+    def with_employee(self, emp_data, template):
+        """Copy with one appended employee; only the new row is normalized."""
+        matrix, means, centered_norms, raw_norms = self.normalize(np.asarray(template).reshape((1,) + FACE_SIZE))
+        gallery = FaceGallery.from_normalized(
+            np.concatenate([self.matrix, matrix]),
+            np.concatenate([self.means, means]),
+            np.concatenate([self.centered_norms, centered_norms]),
+            np.concatenate([self.raw_norms, raw_norms]),
+            self.employees + [emp_data])
+        if self.index is not None:
+            gallery.index = self.index.with_row(matrix[0])
+        return gallery
+    
+    def score(self, faces):
+        faces = np.asarray(faces, dtype=np.uint8).reshape((-1,) + FACE_SIZE)
+        if len(faces) == 0 or len(self) == 0:
+            return np.zeros((len(faces), len(self)), dtype=np.float64)
+        return self.score_vectors(*self.query_vectors(faces))
+    
+    def score_vectors(self, matrix, means, centered_norms, raw_norms, rows=None):
+        pixels = FACE_SIZE[0] * FACE_SIZE[1]
+        if rows is None:
+            gallery = self.matrix.T.astype(np.float32, copy=False)
+            g_means, g_centered, g_raw = self.means, self.centered_norms, self.raw_norms
+        else:
+            gallery = self.matrix[rows].T.astype(np.float32, copy=False)
+            g_means, g_centered, g_raw = self.means[rows], self.centered_norms[rows], self.raw_norms[rows]
+        
+        ccoeff = (matrix @ gallery).astype(np.float64)
+        
+        # sum(T*I) = sum(Tc*Ic) + N*mean(T)*mean(I), so CCORR falls out of the
+        # CCOEFF product without a second pass over the pixels.
+        dot = ccoeff * np.outer(centered_norms, g_centered) + pixels * np.outer(means, g_means)
+        denom = np.outer(raw_norms, g_raw)
+        ccorr = np.divide(dot, denom, out=np.zeros_like(dot), where=denom > 0)
+        
+        return (ccoeff + ccorr) / 2
+    
+    def match(self, faces):
+        return [(self.employees[best] if best >= 0 else None, score)
+                for best, score in self.best_matches(faces)]
+    
+    def best_matches(self, faces, probes=None):
+        if self.index is None or len(self) == 0:
+            scores = self.score(faces)
+            if scores.shape[1] == 0:
+                return [(-1, 0.0)] * len(scores)
+            best = np.argmax(scores, axis=1)
+            return [(int(i), float(scores[row, i])) for row, i in enumerate(best)]
+        
+        faces = np.asarray(faces, dtype=np.uint8).reshape((-1,) + FACE_SIZE)
+        if len(faces) == 0:
+            return []
+        
+        matrix, means, centered_norms, raw_norms = self.query_vectors(faces)
+        results = []
+        for row, rows in enumerate(self.index.candidates(matrix, probes)):
+            if len(rows) == 0:
+                results.append((-1, 0.0))
+                continue
+            one = slice(row, row + 1)
+            scores = self.score_vectors(matrix[one], means[one], centered_norms[one], raw_norms[one], rows)[0]
+            best = int(np.argmax(scores))
+            results.append((int(rows[best]), float(scores[best])))
+        return results
+
+class ProjectedGallery(FaceGallery):
+    """FaceGallery stored as short float16 embeddings instead of pixel rows.
+    
+    The normalized templates are projected onto their leading principal axes
+    (eigenfaces) and renormalized to unit length there, so the CCOEFF term is
+    a cosine in that space (a face against itself still scores 1 at any
+    dims) and the CCORR term is rebuilt from the per-face statistics as
+    before, keeping scores on the MATCH_THRESHOLD scale. Registrations are
+    projected onto the existing basis; the basis is refit on the next load.
+    """
+    
+    def __init__(self, employees=None, templates=None, dims=128, components=None):
+        self.employees = list(employees or [])
+        self.ids = [emp['Employee_ID'] for emp in self.employees]
+        self.templates = None
+        self.index = None
+        
+        if self.employees:
+            stacked = np.stack([np.asarray(t, dtype=np.uint8).reshape(FACE_SIZE) for t in templates])
+        else:
+            stacked = np.zeros((0,) + FACE_SIZE, dtype=np.uint8)
+        
+        matrix, self.means, self.centered_norms, self.raw_norms = self.normalize(stacked)
+        self.components = components if components is not None else self.fit(matrix, dims)
+        self.matrix = self.project(matrix).astype(np.float16)
+    
+    @classmethod
+    def from_normalized(cls, matrix, means, centered_norms, raw_norms, components, employees=None):
+        gallery = super().from_normalized(matrix, means, centered_norms, raw_norms, employees)
+        gallery.components = components
+        return gallery
+    
+    @staticmethod
+    def fit(matrix, dims, sample=EMBEDDING_FIT_SAMPLE):
+        pixels = FACE_SIZE[0] * FACE_SIZE[1]
+        if len(matrix) > sample:
+            rows = np.random.default_rng(0).choice(len(matrix), sample, replace=False)
+            matrix = matrix[np.sort(rows)]
+        if len(matrix) == 0:
+            return np.zeros((0, pixels), dtype=np.float32)
+        
+        # Eigenvectors of the small Gram matrix give the principal axes without
+        # decomposing the 10,000 x 10,000 pixel covariance.
+        values, vectors = np.linalg.eigh((matrix @ matrix.T).astype(np.float64))
+        order = np.argsort(values)[::-1][:dims]
+        order = order[values[order] > 1e-6]
+        components = (vectors[:, order].T @ matrix) / np.sqrt(values[order])[:, None]
+        return np.ascontiguousarray(components, dtype=np.float32)
+    
+    def project(self, matrix, chunk=4096):
+        projected = np.empty((len(matrix), len(self.components)), dtype=np.float32)
+        for start in range(0, len(matrix), chunk):
+            block = matrix[start:start + chunk] @ self.components.T
+            # Dropping the minor axes shortens every vector; without this a
+            # self-match scores well under 1 at low dims.
+            norms = np.linalg.norm(block, axis=1)
+            projected[start:start + chunk] = block / np.where(norms > 0, norms, 1.0)[:, None]
+        return projected
+    
+    def shared_arrays(self):
+        return super().shared_arrays() + (self.components,)
+    
+    def query_vectors(self, faces):
+        matrix, means, centered_norms, raw_norms = self.normalize(faces)
+        return self.project(matrix), means, centered_norms, raw_norms
+    
+    def with_employee(self, emp_data, template):
+        matrix, means, centered_norms, raw_norms = self.normalize(np.asarray(template).reshape((1,) + FACE_SIZE))
+        vector = self.project(matrix).astype(np.float16)
+        gallery = ProjectedGallery.from_normalized(
+            np.concatenate([self.matrix, vector]),
+            np.concatenate([self.means, means]),
+            np.concatenate([self.centered_norms, centered_norms]),
+            np.concatenate([self.raw_norms, raw_norms]),
+            self.components,
+            self.employees + [emp_data])
+        if self.index is not None:
+            gallery.index = self.index.with_row(vector)
+        return gallery
+
+GALLERY_KINDS = {
+    'pixels': FaceGallery,
+    'projected': ProjectedGallery
+}
+
+def gallery_kind(gallery):
+    return 'projected' if isinstance(gallery, ProjectedGallery) else 'pixels'
+
+_worker_state = {
+    'cascade': None,
+    'generation': None,
+    'blocks': [],
+    'gallery': None
+}
+
+def _init_worker(cascade_path):
+    # One OpenCV thread per process; the pool supplies the parallelism.
+    cv2.setNumThreads(1)
+    _worker_state['cascade'] = cv2.CascadeClassifier(cascade_path)
+
+def _attach_gallery(descriptor):
+    if _worker_state['generation'] == descriptor['generation']:
+        return _worker_state['gallery']
+    
+    for block in _worker_state['blocks']:
+        block.close()
+    _worker_state['blocks'] = []
+    _worker_state['gallery'] = None
+    
+    arrays = []
+    for name, shape, dtype in descriptor['arrays']:
+        block = shared_memory.SharedMemory(name=name)
+        _worker_state['blocks'].append(block)
+        arrays.append(np.ndarray(shape, dtype=dtype, buffer=block.buf))
+    
+    probes = descriptor['index_probes']
+    if probes:
+        arrays, (centroids, assignments) = arrays[:-2], arrays[-2:]
+    gallery = GALLERY_KINDS[descriptor['kind']].from_normalized(*arrays)
+    if probes:
+        gallery.index = CoarseIndex(centroids, assignments, probes)
+    _worker_state['gallery'] = gallery
+    _worker_state['generation'] = descriptor['generation']
+    return _worker_state['gallery']
+
+def detect_and_match(gray, descriptor):
+    """Worker task: full-frame Haar detection plus best gallery row for each face."""
+    gallery = _attach_gallery(descriptor)
+    faces = _worker_state['cascade'].detectMultiScale(gray, 1.1, 4, minSize=(50, 50))
+    
+    boxes = [tuple(int(v) for v in box) for box in faces]
+    crops = [cv2.resize(gray[y:y+h, x:x+w], FACE_SIZE) for (x, y, w, h) in boxes]
+    return descriptor['generation'], boxes, gallery.best_matches(crops)
+
+class RecognitionEngine:
+    """Process pool that runs detection and gallery scoring outside the GIL.
+    
+    The normalized gallery arrays live in shared memory. Every publish() writes
+    a new generation; workers attach to it on their next task, so a
+    registration is picked up without restarting the pool.
+    """
+    
+    def __init__(self, workers, cascade_path):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.descriptor = None
+        self.gallery = None
+        self.blocks = []
+        
+        # spawn everywhere: forking a process full of threads and open sockets
+        # is not safe, and it is what Windows does anyway.
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(cascade_path,))
+    
+    def publish(self, gallery):
+        blocks = []
+        arrays = []
+        shared = gallery.shared_arrays()
+        if gallery.index is not None:
+            shared += (gallery.index.centroids, gallery.index.assignments)
+        for array in shared:
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            blocks.append(block)
+            arrays.append((block.name, array.shape, array.dtype.str))
+        
+        with self.lock:
+            self.generation += 1
+            self.descriptor = {
+                'generation': self.generation,
+                'kind': gallery_kind(gallery),
+                'index_probes': gallery.index.probes if gallery.index is not None else 0,
+                'arrays': arrays
+            }
+            self.gallery = gallery
+            old_blocks, self.blocks = self.blocks, blocks
+        
+        # Workers that already mapped the old generation keep their mapping;
+        # unlinking only removes the name.
+        for block in old_blocks:
+            block.close()
+            block.unlink()
+    
+    def analyze(self, gray, timeout=ENGINE_TIMEOUT):
+        for attempt in range(2):
+            with self.lock:
+                descriptor, gallery = self.descriptor, self.gallery
+            
+            try:
+                generation, boxes, best = self.pool.submit(detect_and_match, gray, descriptor).result(timeout)
+            except FileNotFoundError:
+                # The generation was replaced before the worker attached to it
+                if attempt == 0:
+                    continue
+                raise
+            
+            matches = [(gallery.employees[i] if i >= 0 else None, score) for i, score in best]
+            return boxes, matches
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            blocks, self.blocks = self.blocks, []
+        for block in blocks:
+            block.close()
+            block.unlink()
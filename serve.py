@@ -0,0 +1,42 @@
+"""
+Production launcher - the ASGI application (asgi.py) under uvicorn
+Camera streams are served on asyncio, so open viewers don't use up the threads
+that handle /api/process-frame and the dashboard.
+
+    pip install uvicorn "asgiref>=3.7,<4"
+    python serve.py                                  (0.0.0.0:5000)
+    python serve.py --port 8000 --threads 64
+
+For development with auto-reload, keep using: python app.py
+"""
+
+import argparse
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the attendance system for production use')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--threads', type=int, help='threads for the Flask routes (default WSGI_THREADS or 32)')
+    args = parser.parse_args()
+
+    if args.threads:
+        os.environ['WSGI_THREADS'] = str(args.threads)
+
+    try:
+        import uvicorn
+        from asgi import application
+    except ImportError as e:
+        print(f"Missing dependency ({e.name}); install with: pip install uvicorn 'asgiref>=3.7,<4'")
+        return 1
+
+    print(f"Serving on http://{args.host}:{args.port}")
+    # One process: camera readers, recognition workers and the attendance log live in it
+    uvicorn.run(application, host=args.host, port=args.port, workers=1, lifespan='on')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())